@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from PIL import Image
+
+import pipeline
+
+# Modo em lote: processa muitas imagens com um só interpretador. Os filtros são carregados
+# uma vez por processo (e não por imagem), e as imagens são distribuídas entre os processos.
+# Não importa o matplotlib, já que os resultados são sempre salvos.
+
+
+def find_images(inputs):
+    """expande as entradas (diretórios, padrões glob ou arquivos) na lista de imagens a processar"""
+    extensions = set(Image.registered_extensions())
+    paths = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            paths.extend(sorted(str(path) for path in Path(entry).iterdir() if path.suffix.lower() in extensions))
+        elif glob.has_magic(entry):
+            paths.extend(sorted(glob.glob(entry, recursive=True)))
+        else:
+            paths.append(entry)
+    # remove repetições mantendo a ordem
+    return list(dict.fromkeys(paths))
+
+
+# estado de cada processo do lote, preenchido por init_worker
+_worker = {}
+
+
+def init_worker(args):
+    """carrega os filtros uma única vez em cada processo"""
+    _worker['args'] = args
+    _worker['filters'] = pipeline.load_filters(args)
+    _worker['cache'] = pipeline.open_cache(args)
+
+
+def process_file(path):
+    """aplica as operações a uma imagem e salva os resultados; retorna quantos foram salvos"""
+    args, filters = _worker['args'], _worker['filters']
+    img_arr = pipeline.open_image(path, args.grayscale)
+    saved = 0
+    for effect_name, _, result in pipeline.process(img_arr, args, filters, _worker['cache']):
+        pipeline.save_img(result, path, effect_name, args.output_dir)
+        saved += 1
+    return saved
+
+
+def process_all(paths, args):
+    """processa as imagens, em paralelo se houver mais de um processo
+    gera (caminho, exceção ou None) para cada imagem, à medida que terminam"""
+    if args.processes <= 1:
+        for path in paths:
+            try:
+                process_file(path)
+                yield path, None
+            except Exception as e:
+                yield path, e
+        return
+    with ProcessPoolExecutor(args.processes, initializer=init_worker, initargs=(args,)) as executor:
+        futures = {executor.submit(process_file, path): path for path in paths}
+        for future in as_completed(futures):
+            yield futures[future], future.exception()
+
+
+parser = argparse.ArgumentParser(description='apply the same operations to many images', fromfile_prefix_chars='@')
+parser.add_argument('INPUT', nargs='+', help='images, directories or glob patterns to process. @FILE reads more arguments (e.g. a list of images, one per line) from FILE')
+parser.add_argument('--output-dir', help='directory where results are saved (default: next to each image)')
+parser.add_argument('--processes', type=pipeline.workers_count, default=0, help='number of processes handling images in parallel (0 uses all CPUs)')
+pipeline.add_processing_arguments(parser)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    paths = find_images(args.INPUT)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    # carrega os filtros também no processo principal, para validá-los antes de começar
+    init_worker(args)
+
+    failed = 0
+    start = time.perf_counter()
+    for path, error in process_all(paths, args):
+        if error is not None:
+            failed += 1
+            print(f'{path}: {error}', file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    processed = len(paths) - failed
+    print(f'{processed} images processed ({failed} failed) in {elapsed:.2f}s: {processed / elapsed if elapsed else 0:.2f} images/s')
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+import numpy as np
+
+import color
+import filter
+
+# Medição de desempenho: aplica cada filtro json (com cada motor de correlação), cada filtro de
+# função (com vários tamanhos de janela) e cada operação de cor a imagens de vários tamanhos.
+# Os resultados (mediana do tempo, megapixels por segundo e pico de memória) são gravados em JSON,
+# e dois arquivos podem ser comparados para encontrar regressões de desempenho.
+
+FILTERS_DIRECTORY = Path(__file__).resolve().parent.parent / 'filters'
+
+COLOR_OPERATIONS = {
+    'yiq': color.rgb_yiq_rgb,
+    'neg_rgb': color.negative_rgb,
+    'neg_y': color.negative_y,
+}
+
+
+def cases(kernel_sizes, engines):
+    """gera (operação, nome, motor, tamanho da janela, função que recebe a imagem) de cada caso medido"""
+    for name, operation in COLOR_OPERATIONS.items():
+        yield 'color', name, None, None, operation
+    for path in sorted(FILTERS_DIRECTORY.glob('*.json')):
+        for engine in engines:
+            data_filter = filter.DataFilter.from_json(path, engine)
+            yield 'filter', path.stem, engine, list(data_filter.kernel.shape[:2]), data_filter.apply
+    for name in filter.FUNCTIONS_FILTER_TABLE:
+        for size in kernel_sizes:
+            function_filter = filter.get_function_filter(f'[{name},{size},{size},{size // 2},{size // 2},true]')
+            yield 'function', name, None, [size, size], function_filter.apply
+
+
+def measure(function, img_arr, repeat):
+    """tempos de repeat execuções e o pico de memória alocada (em uma execução a mais, com o
+    tracemalloc ligado, para o rastreamento não afetar os tempos)"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(img_arr)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function(img_arr)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+
+def metadata():
+    """ambiente em que a medição foi feita"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=FILTERS_DIRECTORY.parent,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(args):
+    """executa todos os casos em todos os tamanhos de imagem e retorna os resultados"""
+    rng = np.random.default_rng(0)
+    results = []
+    for size in args.sizes:
+        img_arr = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+        for operation, name, engine, kernel, function in cases(args.kernel_sizes, args.engines):
+            if args.only and not any(pattern in name for pattern in args.only):
+                continue
+            times, peak = measure(function, img_arr, args.repeat)
+            median = statistics.median(times)
+            result = {'operation': operation, 'name': name, 'engine': engine, 'kernel': kernel, 'size': size,
+                      'median_s': median, 'times_s': times, 'mpixels_s': size * size / 1e6 / median, 'peak_bytes': peak}
+            results.append(result)
+            print(format_row(result), flush=True)
+    return results
+
+
+def key(result):
+    """identifica o mesmo caso em duas medições"""
+    return (result['operation'], result['name'], result['engine'], tuple(result['kernel'] or ()), result['size'])
+
+
+def label(result):
+    name = result['name'] if result['engine'] is None else f'{result["name"]} ({result["engine"]})'
+    kernel = '' if result['kernel'] is None else 'x'.join(map(str, result['kernel']))
+    return f'{result["operation"]:8} {name:22} {kernel:>5} {result["size"]:>5}'
+
+
+def format_row(result):
+    return f'{label(result)}  {result["median_s"] * 1e3:10.2f} ms  {result["mpixels_s"]:8.2f} MP/s  {result["peak_bytes"] / 2**20:8.1f} MB'
+
+
+def compare(base, new, threshold):
+    """compara duas medições; retorna os casos em que a mediana piorou mais que threshold (fração)"""
+    base_results = {key(result): result for result in base['results']}
+    regressions = []
+    print(f'base: {base["metadata"].get("commit")}  new: {new["metadata"].get("commit")}')
+    for result in new['results']:
+        old = base_results.get(key(result))
+        if old is None:
+            continue
+        ratio = result['median_s'] / old['median_s']
+        regressed = ratio > 1 + threshold
+        if regressed:
+            regressions.append(result)
+        flag = 'REGRESSION' if regressed else ('faster' if ratio < 1 / (1 + threshold) else '')
+        print(f'{label(result)}  {old["median_s"] * 1e3:10.2f} -> {result["median_s"] * 1e3:10.2f} ms  x{ratio:5.2f}  {flag}')
+    return regressions
+
+
+parser = argparse.ArgumentParser(description='benchmark every filter, engine and color operation over a grid of image sizes')
+parser.add_argument('--sizes', type=int, nargs='+', default=[256, 1024], help='side of the square test images, in pixels')
+parser.add_argument('--kernel-sizes', type=int, nargs='+', default=[3, 9], help='window sizes of the function filters ([median], [mode]...)')
+parser.add_argument('--engines', nargs='+', choices=filter.ENGINES, default=list(filter.ENGINES), help='correlation engines of the json filters')
+parser.add_argument('--repeat', type=int, default=5, help='timed runs of each case (the median is reported)')
+parser.add_argument('--only', nargs='+', help='only run cases whose name contains one of these strings')
+parser.add_argument('--output', help='save the results to this JSON file')
+parser.add_argument('--compare', nargs='+', metavar='JSON', help='compare with a saved run (BASE), or compare two saved runs (BASE NEW) without running')
+parser.add_argument('--threshold', type=float, default=0.10, help='slowdown (fraction of the median time) reported as a regression')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.compare and len(args.compare) > 2:
+        parser.error('--compare takes one or two files')
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[0]) as base_file, open(args.compare[1]) as new_file:
+            benchmark = json.load(new_file)
+            base = json.load(base_file)
+    else:
+        benchmark = {'metadata': metadata(), 'results': run(args)}
+        if args.output:
+            with open(args.output, 'w') as file:
+                json.dump(benchmark, file, indent=1)
+        if not args.compare:
+            sys.exit()
+        with open(args.compare[0]) as base_file:
+            base = json.load(base_file)
+
+    regressions = compare(base, benchmark, args.threshold)
+    print(f'{len(regressions)} regressions')
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+
+# Cache de resultados endereçado pelo conteúdo: a chave de um resultado é o hash da imagem
+# decodificada junto com a descrição canônica das operações (ver AbstractFilter.spec), então
+# o mesmo filtro em outro arquivo, ou a mesma imagem com outro nome, reaproveitam o resultado.
+# Os resultados ficam em arquivos .npy no diretório do cache e, opcionalmente, em memória.
+
+DEFAULT_DIRECTORY = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'pdi2023'
+
+# versão do formato das chaves e dos arquivos; junto com o código que calcula os resultados,
+# entra em todas as chaves, então resultados de outra versão do programa nunca são reaproveitados
+FORMAT_VERSION = 1
+CODE_FILES = ('cache.py', 'color.py', 'filter.py', 'pipeline.py')
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    """hash da versão do formato e do código-fonte dos módulos que calculam os resultados"""
+    digest = hashlib.sha256(str(FORMAT_VERSION).encode())
+    for name in CODE_FILES:
+        digest.update((Path(__file__).resolve().parent / name).read_bytes())
+    return digest.hexdigest()
+
+
+def image_key(img_arr):
+    """hash do conteúdo da imagem (dimensões, tipo e pixels)"""
+    digest = hashlib.sha256(f'{img_arr.shape}{img_arr.dtype}'.encode())
+    digest.update(np.ascontiguousarray(img_arr).data)
+    return digest.hexdigest()
+
+
+def operation_key(image, operation):
+    """chave de um resultado: o hash da imagem e a descrição (serializável em JSON) da operação"""
+    return hashlib.sha256(json.dumps([code_version(), image, operation], sort_keys=True).encode()).hexdigest()
+
+
+class ResultCache:
+    """cache de arrays em disco, limitado a max_bytes (os menos usados recentemente são removidos),
+    com um cache opcional em memória de até memory_bytes
+    com directory None o cache fica só em memória (usado pelo modo --watch e por --cache-memory sem --cache)"""
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=1 << 30, memory_bytes=0):
+        self.directory = None if directory is None else Path(directory)
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()
+        self.memory_total = 0
+        # tamanho dos arquivos do diretório, calculado na primeira gravação e mantido a cada uma;
+        # o diretório só é percorrido de novo quando o limite é excedido (os arquivos gravados
+        # por outros processos entram na conta nesse momento)
+        self.disk_total = None
+        # o cache em memória pode ser compartilhado por várias threads (ver server.py)
+        self.lock = threading.Lock()
+
+    def _path(self, key):
+        return self.directory / f'{key}.npy'
+
+    def get(self, key):
+        """retorna o array guardado com a chave, ou None"""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            array = np.load(path)
+            # a data de modificação marca o último uso, para a remoção dos menos usados
+            os.utime(path)
+        except (OSError, ValueError):
+            # ausente, removido por outro processo ou corrompido
+            return None
+        self._remember(key, array)
+        return array
+
+    def put(self, key, array):
+        """guarda o array com a chave e remove os resultados mais antigos se o limite for excedido"""
+        self._remember(key, array)
+        if self.directory is None:
+            return
+        # grava em um arquivo temporário e renomeia, para outros processos nunca lerem um arquivo incompleto
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as file:
+            np.save(file, array)
+        path = self._path(key)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(file.name, path)
+        with self.lock:
+            if self.disk_total is not None:
+                self.disk_total += os.path.getsize(path) - replaced
+            exceeded = self.disk_total is None or self.disk_total > self.max_bytes
+        if exceeded:
+            self.evict()
+
+    def _remember(self, key, array):
+        if array.nbytes > self.memory_bytes:
+            return
+        with self.lock:
+            if key in self.memory:
+                self.memory_total -= self.memory[key].nbytes
+            self.memory[key] = array
+            self.memory.move_to_end(key)
+            self.memory_total += array.nbytes
+            while self.memory_total > self.memory_bytes:
+                _, removed = self.memory.popitem(last=False)
+                self.memory_total -= removed.nbytes
+
+    def evict(self):
+        """remove os arquivos usados há mais tempo até o cache caber em max_bytes"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self.lock:
+            self.disk_total = total
+
+    def cached(self, key, compute):
+        """retorna o resultado guardado com a chave ou o calcula com compute() e o guarda"""
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+# Cliente do modo servidor (ver server.py): envia os argumentos ao servidor e mostra onde os
+# resultados foram salvos. Importa só a biblioteca padrão (e o NumPy para os resultados em
+# memória), para iniciar rápido.
+
+# os mesmos do server.py (o diretório é o cache.DEFAULT_DIRECTORY)
+DEFAULT_PORT = 8765
+DEFAULT_DIRECTORY = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'pdi2023'
+DEFAULT_SOCKET = DEFAULT_DIRECTORY / 'server.sock'
+DEFAULT_TOKEN_FILE = DEFAULT_DIRECTORY / 'server.token'
+
+
+def connect(port=None, socket_path=None):
+    """conecta ao servidor pela porta TCP em localhost, se for dada (ou se não houver sockets Unix),
+    ou pelo socket Unix socket_path (por padrão, o do servidor)"""
+    if port is None and hasattr(socket, 'AF_UNIX'):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(str(DEFAULT_SOCKET if socket_path is None else socket_path))
+        return connection
+    return socket.create_connection(('127.0.0.1', DEFAULT_PORT if port is None else port))
+
+
+def submit(argv, port=None, socket_path=None, raw=False, token_file=DEFAULT_TOKEN_FILE):
+    """envia um trabalho com os argumentos argv (como os do src/batch.py) e retorna a lista de resultados
+    cada resultado tem a imagem, o efeito e o arquivo salvo ou, com raw, o array da imagem resultante
+    em TCP, o trabalho leva o token que o servidor gravou em token_file"""
+    with connect(port, socket_path) as connection, connection.makefile('rb') as response:
+        request = {'argv': list(argv), 'cwd': os.getcwd(), 'raw': raw}
+        if connection.family != getattr(socket, 'AF_UNIX', None):
+            request['token'] = Path(token_file).read_text().strip()
+        connection.sendall(json.dumps(request).encode() + b'\n')
+        header = json.loads(response.readline())
+        if 'error' in header:
+            raise ValueError(header['error'])
+        results = header['results']
+        if raw:
+            import numpy as np
+            for result in results:
+                if 'shape' in result:
+                    shape = result['shape']
+                    result['array'] = np.frombuffer(response.read(shape[0] * shape[1] * shape[2]), dtype=np.uint8).reshape(shape)
+        return results
+
+
+parser = argparse.ArgumentParser(description='send a job to the image processing server. Other arguments are those of src/batch.py (images and processing options)')
+parser.add_argument('--socket', help=f'Unix socket of the server (default: {DEFAULT_SOCKET})')
+parser.add_argument('--port', type=int, help=f'connect to this localhost TCP port instead (e.g. {DEFAULT_PORT}), sending the token in --token-file')
+parser.add_argument('--token-file', default=str(DEFAULT_TOKEN_FILE), help='file with the token of a TCP server (default: %(default)s)')
+parser.add_argument('--raw-dir', help='receive the resulting pixels instead of having the server save them, and write them as .npy files to this directory')
+
+if __name__ == '__main__':
+    args, job = parser.parse_known_args()
+    try:
+        results = submit(job, args.port, args.socket, raw=args.raw_dir is not None, token_file=args.token_file)
+    except (OSError, ValueError) as e:
+        sys.exit(f'error: {e}')
+
+    failed = 0
+    for result in results:
+        if 'error' in result:
+            failed += 1
+            print(f'{result["image"]}: {result["error"]}', file=sys.stderr)
+        elif args.raw_dir is not None:
+            import numpy as np
+            os.makedirs(args.raw_dir, exist_ok=True)
+            stem = os.path.splitext(os.path.basename(result['image']))[0]
+            path = os.path.join(args.raw_dir, f'{stem}_{result["effect"]}.npy')
+            np.save(path, result['array'])
+            print(path)
+        else:
+            print(result['file'])
+    sys.exit(1 if failed else 0)
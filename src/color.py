@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+from dataclasses import dataclass
+from functools import reduce
+import numpy as np
+
+RGB_TO_YIQ_MATRIX = np.array([
+                              [0.299, 0.587, 0.114],
+                              [0.596, -0.274, -0.322],
+                              [0.211, -0.523, 0.312]
+                            ])
+
+YIQ_TO_RGB_MATRIX = np.array([
+                                [1.000, 0.956, 0.621],
+                                [1.000, -0.272, -0.647],
+                                [1.000, -1.106, 1.703]
+                            ])
+
+# As operações abaixo são feitas pixel a pixel, então podem ser aplicadas tanto à imagem
+# inteira quanto a faixas de linhas da imagem.
+# Cada operação recebe as cores normalizadas (entre 0 e 1, em float64). Uma sequência de operações
+# é compilada (ver PointOperation) em uma única passada sobre a imagem: as transformações afins
+# seguidas viram uma só matriz, e as operações só de canal viram tabelas de 256 valores.
+
+
+@dataclass(frozen=True)
+class Affine:
+    """transformação afim das cores de cada pixel: cor . matrix^T + bias"""
+    matrix: np.ndarray
+    bias: tuple = (0, 0, 0)
+
+    def __call__(self, x):
+        return np.dot(x, self.matrix.T) + np.asarray(self.bias, dtype=float)
+
+
+@dataclass(frozen=True)
+class ChannelMap:
+    """função em que cada canal da saída depende só do mesmo canal da entrada
+    (recebe e retorna arrays (..., 3)), e que por isso pode ser tabelada"""
+    function: callable
+
+    def __call__(self, x):
+        return self.function(x)
+
+
+def _compose(first, second):
+    """uma operação equivalente a aplicar first e depois second, quando as duas são do mesmo tipo"""
+    if isinstance(first, Affine):
+        return Affine(second.matrix @ first.matrix, second.matrix @ np.asarray(first.bias, dtype=float) + np.asarray(second.bias, dtype=float))
+    return ChannelMap(lambda x: second.function(first.function(x)))
+
+
+# inversão do Y no espaço YIQ (Y' = 1 - Y), escrita como transformação afim para ser composta com as conversões
+INVERT_Y = Affine(np.diag([-1.0, 1.0, 1.0]), (1, 0, 0))
+RGB_TO_YIQ = Affine(RGB_TO_YIQ_MATRIX)
+YIQ_TO_RGB = Affine(YIQ_TO_RGB_MATRIX)
+NEGATIVE = ChannelMap(lambda x: 1 - x)
+
+
+def gamma(value):
+    """correção gama de cada canal"""
+    return ChannelMap(lambda x: np.power(np.clip(x, 0, 1), value))
+
+
+def levels(low, high):
+    """expande o intervalo [low, high] (valores de 0 a 255) de cada canal para [0, 255]"""
+    if not 0 <= low < high <= 255:
+        raise ValueError(f'levels needs 0 <= low < high <= 255, got low={low} and high={high}')
+    return ChannelMap(lambda x: (x - low / 255) / ((high - low) / 255))
+
+
+class PointOperation:
+    """sequência de operações pixel a pixel compilada para imagens RGB de 8 bits
+    se todas as operações forem só de canal, a sequência vira uma tabela de 256 valores por canal,
+    aplicada direto aos valores de 8 bits; senão as operações seguidas do mesmo tipo são compostas,
+    e a imagem é processada em blocos de linhas, em float32 e com buffers reaproveitados"""
+
+    # pixels processados de cada vez (os buffers de um bloco cabem no cache)
+    CHUNK_PIXELS = 1 << 16
+    # o resultado em float32 difere do calculado em float64 em menos que isso; os pixels que ficam
+    # mais perto que isso de um empate no arredondamento são recalculados com as operações originais
+    TIE_TOLERANCE = 1e-3
+
+    def __init__(self, *operations):
+        self.operations = operations
+        stages = list(reduce(lambda stages, op: stages[:-1] + [_compose(stages[-1], op)]
+                             if stages and type(stages[-1]) is type(op) else stages + [op], operations, []))
+        values = np.repeat(np.arange(256)[:, np.newaxis], 3, axis=1)
+        self.lut = None
+        self.table = None
+        if all(isinstance(stage, ChannelMap) for stage in stages):
+            # tabela exata: as 256 entradas são calculadas como pixels comuns
+            self.lut = self.reference(values.astype(np.uint8)[:, np.newaxis])[:, 0]
+            self.uniform = bool(np.all(self.lut == self.lut[:, :1]))
+            # a tabela do negativo (255 - valor) é aplicada com aritmética de 8 bits, mais rápida que a indexação no NumPy
+            self.complement = self.uniform and bool(np.all(self.lut[:, 0] == 255 - np.arange(256)))
+            return
+        if isinstance(stages[0], ChannelMap):
+            self.table = stages.pop(0)(values / 255).astype(np.float32)
+        else:
+            # a normalização da entrada (/ 255) entra na primeira matriz
+            stages[0] = Affine(stages[0].matrix / 255, stages[0].bias)
+        # e a volta para 0..255 entra na última, se for uma transformação afim
+        self.output_scale = 255
+        if isinstance(stages[-1], Affine):
+            stages[-1] = Affine(stages[-1].matrix * 255, np.asarray(stages[-1].bias, dtype=float) * 255)
+            self.output_scale = 1
+        self.stages = [(stage.matrix.T.astype(np.float32), np.asarray(stage.bias, dtype=np.float32)) if isinstance(stage, Affine) else stage
+                       for stage in stages]
+
+    def reference(self, img_arr):
+        """aplica as operações uma a uma, em float64, como nas versões originais das funções"""
+        x = img_arr / 255
+        for operation in self.operations:
+            x = operation(x)
+        return np.clip(x * 255, 0, 255).round().astype(np.uint8)
+
+    def __call__(self, img_arr, out=None):
+        """aplica a operação à imagem (linhas x colunas x 3, uint8), escrevendo em out se for dado"""
+        if out is None:
+            out = np.empty(img_arr.shape, dtype=np.uint8)
+        if self.lut is not None:
+            if self.complement:
+                return np.subtract(255, img_arr, out=out, dtype=np.uint8)
+            if self.uniform:
+                return np.take(self.lut[:, 0], img_arr, out=out)
+            for channel in range(3):
+                out[:, :, channel] = np.take(self.lut[:, channel], img_arr[:, :, channel])
+            return out
+
+        rows, columns = img_arr.shape[:2]
+        chunk_rows = max(1, self.CHUNK_PIXELS // max(columns, 1))
+        buffer = np.empty((chunk_rows, columns, 3), dtype=np.float32)
+        work = np.empty_like(buffer)
+        for start in range(0, rows, chunk_rows):
+            chunk = img_arr[start:start + chunk_rows]
+            x, y = buffer[:chunk.shape[0]], work[:chunk.shape[0]]
+            if self.table is not None:
+                x[...] = self.table[chunk, np.arange(3)]
+            else:
+                np.copyto(x, chunk, casting='unsafe')
+            for stage in self.stages:
+                if isinstance(stage, ChannelMap):
+                    x[...] = stage(x)
+                    continue
+                np.matmul(x, stage[0], out=y)
+                y += stage[1]
+                x, y = y, x
+            if self.output_scale != 1:
+                x *= self.output_scale
+            # pixels perto de um empate no arredondamento (entre 0 e 255, fora do clip)
+            ties = np.any((np.abs(x - np.floor(x) - 0.5) < self.TIE_TOLERANCE) & (x > -1) & (x < 256), axis=2)
+            np.clip(x, 0, 255, out=x)
+            np.rint(x, out=x)
+            result = out[start:start + chunk.shape[0]]
+            np.copyto(result, x, casting='unsafe')
+            if ties.any():
+                result[ties] = self.reference(chunk[ties][:, np.newaxis])[:, 0]
+        return out
+
+
+_RGB_YIQ_RGB = PointOperation(RGB_TO_YIQ, YIQ_TO_RGB)
+_NEGATIVE_RGB = PointOperation(NEGATIVE)
+_NEGATIVE_Y = PointOperation(RGB_TO_YIQ, INVERT_Y, YIQ_TO_RGB)
+
+# Realiza uma operação de conversão de espaço de cores da imagem de RGB para YIQ e novamente de volta para RGB
+def rgb_yiq_rgb(img_arr):
+    return _RGB_YIQ_RGB(img_arr)
+
+# Negativo em RGB
+def negative_rgb(img_arr):
+    return _NEGATIVE_RGB(img_arr)
+
+# Negativo em Y
+def negative_y(img_arr):
+    return _NEGATIVE_Y(img_arr)
@@ -1,34 +1,123 @@
 # -*- coding: utf-8 -*-
+import shutil
+import sys
+import numpy as np
 from matplotlib import pyplot as plt
 
-# função que imprime a imagem no terminal
-def _terminal_img_printing(img_array, pixel_function, end_line, end):
-    # inicializa a string que armazenará os caracteres de cada pixel
-    str = ''
-    # itera sobre cada pixel da imagem
-    for i in range(img_array.shape[0]):
-        for j in range(img_array.shape[1]):
-            # chama a função pixel_function para obter a representação do pixel
-            str += pixel_function(img_array[i][j])
-        # adiciona uma quebra de linha ao final de cada linha da imagem
-        str += '\x1b[0m\n'
-    print(str) # imprime a imagem
-    print('\x1b[0m', end='') # imprime o caractere de reset de cor ao final da imagem
+# caractere de meio bloco superior: a cor do texto pinta a metade de cima da célula e a cor
+# de fundo a metade de baixo, então cada célula do terminal mostra dois pixels (um sobre o outro)
+HALF_BLOCK = '▀'
+RESET = '\x1b[0m'
+# largura de um pixel em terminal_numbers ('[RRR,GGG,BBB]')
+NUMBER_WIDTH = 13
+# representação com três dígitos de cada valor de 8 bits
+DIGITS = np.array([f'{value:03d}' for value in range(256)], dtype=object)
 
 
-# função que exibe a imagem no terminal com cores
-def terminal(img_array, name='Resulting Image'):
+def _terminal_size(size=None):
+    """(colunas, linhas) disponíveis para a imagem, deixando linhas para o título e o prompt;
+    None se a saída não for um terminal (redirecionada para um arquivo ou pipe), para a imagem sair inteira"""
+    if size is None and not sys.stdout.isatty():
+        return None
+    columns, lines = size or shutil.get_terminal_size()
+    return max(columns, 1), max(lines - 2, 1)
+
+
+def _fit(img_array, columns, rows):
+    """reduz a imagem tomando um pixel a cada step, para caber em columns x rows pixels"""
+    step = max(1, -(-img_array.shape[1] // columns), -(-img_array.shape[0] // rows))
+    return img_array[::step, ::step], step
+
+
+def _color_codes(colors, layer):
+    """códigos ANSI de cor (layer 38: texto, 48: fundo) de cada pixel de colors (linhas x colunas x 3)
+    só a primeira célula de cada sequência de cores iguais em uma linha recebe o código,
+    as outras recebem '' (a cor continua valendo no terminal)"""
+    packed = (colors[:, :, 0].astype(np.int32) << 16) | (colors[:, :, 1].astype(np.int32) << 8) | colors[:, :, 2]
+    # um código por cor diferente, e não por pixel
+    unique, inverse = np.unique(packed, return_inverse=True)
+    table = np.array([f'\x1b[{layer};2;{color >> 16};{color >> 8 & 255};{color & 255}m' for color in unique.tolist()] + [''], dtype=object)
+    inverse = inverse.reshape(packed.shape)
+    repeated = np.zeros(packed.shape, dtype=bool)
+    repeated[:, 1:] = packed[:, 1:] == packed[:, :-1]
+    inverse[repeated] = len(unique)
+    return table[inverse]
+
+
+def _print_lines(cells, name):
+    """imprime o título e as células (array de strings linhas x colunas), uma linha por vez
+    retorna o número de linhas impressas"""
     print(name)
-                                            # colors on terminal                  # reset color 
-    _terminal_img_printing(img_array, lambda x: f'\x1b[48;2;{x[0]};{x[1]};{x[2]}m  ', '\x1b[0m\n', '\x1b[0m')
+    print(''.join(line for row in cells for line in (''.join(row), RESET, '\n')), end='')
+    print(RESET, end='') # imprime o caractere de reset de cor ao final da imagem
+    return len(cells) + 1
+
+
+# função que exibe a imagem no terminal com cores
+def terminal(img_array, name='Resulting Image', size=None):
+    size = _terminal_size(size)
+    img_array, step = _fit(img_array, size[0], 2 * size[1]) if size else (img_array, 1)
+    if step > 1:
+        name = f'{name} (1:{step})'
+    top = img_array[0::2]
+    bottom = img_array[1::2]
+    foreground = _color_codes(top, 38)
+    if bottom.shape[0] == 0:
+        # imagem de uma linha: sem fundo
+        background = np.full(top.shape[:2], '', dtype=object)
+    else:
+        background = _color_codes(bottom, 48)
+    if bottom.shape[0] < top.shape[0]:
+        # número ímpar de linhas: a metade de baixo da última linha fica com o fundo padrão
+        last = np.full((1, top.shape[1]), '', dtype=object)
+        last[0, 0] = '\x1b[49m'
+        background = np.concatenate((background, last)) if bottom.shape[0] else last
+    return _print_lines(foreground + background + HALF_BLOCK, name)
+
 
 # função que exibe a imagem no terminal como uma matriz de números RGB
-def terminal_numbers(img_arr, name='Resulting Image'):
-    print(name)
-    _terminal_img_printing(img_arr, lambda x: f'[{x[0]:03d},{x[1]:03d},{x[2]:03d}]', '', '')
+def terminal_numbers(img_arr, name='Resulting Image', size=None):
+    size = _terminal_size(size)
+    img_arr, step = _fit(img_arr, max(size[0] // NUMBER_WIDTH, 1), size[1]) if size else (img_arr, 1)
+    if step > 1:
+        name = f'{name} (1:{step})'
+    digits = DIGITS[img_arr]
+    return _print_lines('[' + digits[:, :, 0] + ',' + digits[:, :, 1] + ',' + digits[:, :, 2] + ']', name)
 
 # função que exibe a imagem usando o matplotlib
-def matplotlib_imshow(img_array, name='Resulting Image'):
+# block=False mostra a janela e retorna (a próxima imagem é desenhada na mesma janela)
+def matplotlib_imshow(img_array, name='Resulting Image', block=True):
+    plt.clf()
     plt.title(name)
     plt.imshow(img_array)
-    plt.show()
+    plt.show(block=block)
+    if not block:
+        plt.pause(0.001)
+
+
+def matplotlib_wait():
+    """mantém a janela do matplotlib respondendo enquanto o programa espera"""
+    plt.pause(0.05)
+
+
+def preview(output, img_array, name):
+    """mostra uma prévia, que será substituída pela próxima imagem exibida (ver src/preview.py)
+    retorna uma função que apaga a prévia antes da próxima imagem"""
+    if output == 'matplotlib':
+        # a próxima imagem é desenhada na mesma janela
+        matplotlib_imshow(img_array, name, block=False)
+        return lambda: None
+    lines = {'terminal': terminal, 'terminal-numbers': terminal_numbers}[output](img_array, name)
+    # volta o cursor para o título da prévia e apaga até o fim da tela
+    return lambda: print(f'\x1b[{lines}F\x1b[J', end='')
+
+
+def clear_terminal():
+    """apaga a tela do terminal e volta o cursor para o início"""
+    print('\x1b[H\x1b[2J', end='')
+
+
+def matplotlib_update(img_array, name):
+    """mostra a imagem na janela do matplotlib com o título name, criada se ainda não existir, sem bloquear"""
+    plt.figure(name)
+    matplotlib_imshow(img_array, name, block=False)
@@ -1,20 +1,246 @@
 # -*- coding: utf-8 -*-
 
 import json #Importa a biblioteca json para ler arquivos .json
+import hashlib
+import marshal
 import numpy as np 
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from pathlib import Path
 from functools import partial
 import statistics as stats
+from concurrent.futures import ThreadPoolExecutor
+import tempfile
 
-def histogram_expansion(arr):
-	"""expande o histograma de uma imagem"""
+import profiling
+
+def histogram_expansion(arr, bounds=None):
+	"""expande o histograma de uma imagem
+	bounds: (mínimos, máximos) de cada banda, quando a imagem é processada em partes"""
 	arr = arr.copy()
 	for i in range(arr.shape[-1]):
 		band = arr[:,:,i]
-		arr[:,:,i] = np.round(((band - np.min(band)) / (np.max(band) - np.min(band))) * 255)
+		low, high = (np.min(band), np.max(band)) if bounds is None else (bounds[0][i], bounds[1][i])
+		# uma banda constante fica com 0, sem dividir por zero
+		arr[:,:,i] = np.round(((band - low) / (high - low if high != low else 1)) * 255)
 	return arr
 
+def band_bounds(arr, bounds=None):
+	"""mínimo e máximo de cada banda de arr (linhas x colunas x bandas), combinados com bounds
+	(os de outras partes da mesma imagem), se houver
+	cada um é uma só redução para todas as bandas, primeiro ao longo das linhas (sobre dados
+	contíguos, muito mais rápida que reduzir cada banda separadamente) e depois das colunas"""
+	rows = arr.reshape(arr.shape[0], -1)
+	low = np.min(rows, axis=0).reshape(-1, arr.shape[-1]).min(axis=0)
+	high = np.max(rows, axis=0).reshape(-1, arr.shape[-1]).max(axis=0)
+	if bounds is None:
+		return low, high
+	return np.minimum(bounds[0], low), np.maximum(bounds[1], high)
+
+def stream_histogram_expansion(strips):
+	"""expande o histograma de uma imagem recebida em faixas de linhas
+	as faixas são guardadas em um arquivo temporário enquanto o mínimo e o máximo de cada
+	banda são calculados, e depois lidas de novo para a expansão"""
+	with tempfile.TemporaryFile() as spill:
+		shapes = []
+		bounds = None
+		for strip in strips:
+			spill.write(np.ascontiguousarray(strip).tobytes())
+			shapes.append((strip.shape, strip.dtype))
+			bounds = band_bounds(strip, bounds)
+		spill.seek(0)
+		for shape, dtype in shapes:
+			strip = np.frombuffer(spill.read(int(np.prod(shape)) * dtype.itemsize), dtype=dtype).reshape(shape)
+			yield histogram_expansion(strip, bounds)
+
+# pixels processados de cada vez pelo final fundido dos filtros (os blocos cabem no cache, ver epilogue)
+EPILOGUE_CHUNK_PIXELS = 1 << 16
+
+def epilogue(new_img, offset=0, limit='clip', expansion=False, rounding=True):
+	"""offset, limite (pelo nome, ou None), arredondamento e expansão de histograma em uma passada, bloco a bloco
+	o resultado é igual ao das funções de LIMIT_FUNCTIONS seguidas de histogram_expansion"""
+	# o resultado de uma correlação é sobrescrito; as outras entradas são copiadas uma vez
+	if new_img.dtype == np.float64 and new_img.flags.writeable and new_img.flags.owndata and new_img.flags.c_contiguous:
+		buffer = new_img
+	else:
+		buffer = np.array(new_img, dtype=float, order='C')
+	if buffer.size == 0:
+		return buffer
+	step = max(1, EPILOGUE_CHUNK_PIXELS // max(buffer.shape[1], 1))
+	chunks = [buffer[start:start + step] for start in range(0, buffer.shape[0], step)]
+	# as operações por banda usam vetores do tamanho de uma linha inteira (colunas x bandas),
+	# em vez de vetores de 3 valores, que o NumPy aplica bem mais devagar
+	columns = buffer.shape[1]
+	renormalize = limit in ('renormalize', 'abs-renormalize')
+	expansions = int(renormalize) + int(expansion)
+	bounds = None
+	for chunk in chunks:
+		if offset:
+			chunk += offset
+		if limit in ('absolute', 'abs-renormalize'):
+			np.abs(chunk, out=chunk)
+		if limit in ('clip', 'absolute'):
+			np.clip(chunk, 0, 255, out=chunk)
+			if rounding:
+				np.rint(chunk, out=chunk)
+		if expansions:
+			bounds = band_bounds(chunk, bounds)
+	for remaining in reversed(range(expansions)):
+		low, high = bounds
+		span = np.tile(np.where(high > low, high - low, 1), columns)
+		low = np.tile(low, columns)
+		bounds = None
+		for chunk in chunks:
+			flat = chunk.reshape(chunk.shape[0], -1)
+			flat -= low
+			flat /= span
+			flat *= 255
+			np.rint(flat, out=flat)
+			# a expansão seguinte (renormalize seguido de histogram_expansion) usa os novos limites
+			if remaining:
+				bounds = band_bounds(chunk, bounds)
+	return buffer
+
+def separable_decomposition(kernel, tolerance=1e-9):
+	"""decompõe cada canal do kernel em uma soma de produtos externos (coluna x linha)
+	retorna uma lista de pares (fator coluna (m, 3), fator linha (n, 3)), ou None se a
+	decomposição não reduzir o número de operações por pixel"""
+	rows, columns, channels = kernel.shape
+	channel_factors = []
+	for c in range(channels):
+		band = kernel[:, :, c].astype(float)
+		scale = np.max(np.abs(band))
+		if scale == 0:
+			channel_factors.append([])
+			continue
+		# tenta primeiro a fatoração de posto 1 a partir do maior elemento,
+		# que mantém exatos os kernels com pesos inteiros (ex: sobel)
+		i, j = np.unravel_index(np.argmax(np.abs(band)), band.shape)
+		factors = [(band[:, j] / band[i, j], band[i, :])]
+		# se não for posto 1, usa a decomposição em valores singulares
+		if np.max(np.abs(band - np.outer(*factors[0]))) > tolerance * scale:
+			u, sigma, vt = np.linalg.svd(band)
+			rank = int(np.sum(sigma > tolerance * sigma[0]))
+			factors = [(u[:, k] * sigma[k], vt[k]) for k in range(rank)]
+		channel_factors.append(factors)
+
+	# só vale a pena se r * (m + n) operações forem menos que as m * n da correlação direta
+	rank = max(len(factors) for factors in channel_factors)
+	if rank * (rows + columns) >= rows * columns:
+		return None
+
+	# junta os canais em cada termo; canais de posto menor recebem fatores nulos
+	decomposition = []
+	for k in range(rank):
+		column_factor = np.zeros((rows, channels))
+		row_factor = np.zeros((columns, channels))
+		for c, factors in enumerate(channel_factors):
+			if k < len(factors):
+				column_factor[:, c], row_factor[:, c] = factors[k]
+		decomposition.append((column_factor, row_factor))
+	return decomposition
+
+# motores de correlação disponíveis para DataFilter
+# auto: escolhe o mais barato segundo o modelo de custo em DataFilter.select_engine
+ENGINES = ('auto', 'direct', 'separable', 'fft')
+
+# custo relativo (em passes de multiplicação e soma sobre a imagem) de cada log2 do tamanho
+# de um bloco da FFT, considerando FFT direta, produto e FFT inversa
+FFT_COST = 0.3
+# custo relativo de um passe acumulado em inteiros (int16/int32, ver DataFilter.integer_plan)
+# em relação a um passe em float64
+INTEGER_COST = 0.5
+# pixels da saída acumulados de cada vez pela correlação direta (o bloco e o produto cabem no cache)
+DIRECT_BLOCK_PIXELS = 1 << 15
+# maior bloco usado pela FFT em cada eixo (overlap-save)
+FFT_MAX_BLOCK = 512
+# casas decimais em que o resultado da FFT é arredondado quando não pode ser corrigido pela escala
+# diádica; o erro dela é da ordem de 1e-12, então regiões constantes ficam constantes
+FFT_DECIMALS = 9
+
+def dyadic_scale(kernel, max_exponent=24):
+	"""menor potência de 2 que torna inteiros todos os pesos do kernel (None se não houver)
+	com imagem inteira, o resultado exato da correlação é múltiplo de 1 / escala"""
+	for exponent in range(max_exponent + 1):
+		scaled = kernel * 2.0 ** exponent
+		if np.all(scaled == np.round(scaled)):
+			return 2.0 ** exponent
+	return None
+
+def accumulator_dtype(bound):
+	"""menor tipo inteiro que guarda valores de -bound a bound (None se nem int32 servir)"""
+	for dtype in (np.int16, np.int32):
+		if bound <= np.iinfo(dtype).max:
+			return np.dtype(dtype)
+	return None
+
+def integer_factors(band):
+	"""fatores inteiros (coluna, linha) de uma matriz de inteiros de posto até 1, ou None
+	a coluna é uma coluna não nula dividida pelo mdc dos seus elementos; como ela é primitiva,
+	a linha que reconstrói a matriz também é inteira"""
+	nonzero = np.flatnonzero(np.any(band != 0, axis=0))
+	if nonzero.size == 0:
+		return np.zeros(band.shape[0], dtype=np.int64), np.zeros(band.shape[1], dtype=np.int64)
+	column = band[:, nonzero[0]] // np.gcd.reduce(band[:, nonzero[0]])
+	i = np.flatnonzero(column)[0]
+	row = band[i] // column[i]
+	if not np.array_equal(np.outer(column, row), band):
+		return None
+	return column, row
+
+def kernel_taps(kernel):
+	"""elementos não nulos de um kernel (linhas x colunas x canais, ou um fator de linhas x canais),
+	em ordem: tuplas (índices..., peso); os nulos não mudam a soma e são pulados
+	o peso é um escalar quando é igual nos três canais (como nos kernels de um canal repetidos por
+	self_check), e então o passe multiplica a imagem inteira por ele, sem o broadcast de um vetor
+	de 3 pesos a cada pixel; senão é o vetor com o peso de cada canal"""
+	taps = []
+	for index in np.ndindex(kernel.shape[:-1]):
+		weights = kernel[index]
+		if not np.any(weights):
+			continue
+		taps.append(index + (weights[0] if np.all(weights == weights[0]) else weights,))
+	return taps
+
+def row_taps(taps, columns):
+	"""taps (ver kernel_taps) com os vetores de pesos por canal repetidos ao longo de uma linha
+	(colunas x 3): o produto com a imagem percorre a linha inteira, sem vetores de 3 valores"""
+	return [tap[:-1] + (tap[-1] if np.ndim(tap[-1]) == 0 else np.tile(tap[-1], (columns, 1)),) for tap in taps]
+
+def point_lookup(table, image_array):
+	"""aplica a tabela de 256 valores por canal (256 x 3) a uma imagem de 8 bits"""
+	new_img = np.empty(image_array.shape, dtype=table.dtype)
+	for channel in range(image_array.shape[2]):
+		new_img[:, :, channel] = np.take(table[:, channel], image_array[:, :, channel])
+	return new_img
+
+def fft_block_size(image_size, kernel_size):
+	"""tamanho (potência de 2) do bloco da FFT em um eixo para o overlap-save"""
+	full_size = 1 << int(np.ceil(np.log2(image_size + kernel_size - 1)))
+	# o bloco precisa ser bem maior que o kernel para que a sobreposição não domine o custo
+	block_size = max(FFT_MAX_BLOCK, 1 << int(np.ceil(np.log2(4 * kernel_size))))
+	return min(full_size, block_size)
+
+def run_tiled(correlate, img_padded, rows, columns, window_rows, workers=1, tile_rows=None):
+	"""aplica correlate(imagem, linhas, colunas) em faixas de tile_rows linhas da área de aplicação,
+	em paralelo com workers threads (as operações do NumPy liberam o GIL)
+	cada faixa recebe um halo de window_rows - 1 linhas (pivô acima, o resto do kernel abaixo),
+	então o resultado é idêntico ao de uma única chamada sobre a imagem inteira"""
+	if rows < 1 or (workers <= 1 and tile_rows is None):
+		return correlate(img_padded, rows, columns)
+	# por padrão, algumas faixas por thread para equilibrar a carga
+	if tile_rows is None:
+		tile_rows = -(-rows // (4 * workers))
+	new_img = np.empty((rows, columns, img_padded.shape[2]))
+
+	def run(start):
+		height = min(tile_rows, rows - start)
+		new_img[start:start + height] = correlate(img_padded[start:start + height + window_rows - 1], height, columns)
+
+	with ThreadPoolExecutor(max(workers, 1)) as executor:
+		# list() propaga as exceções das threads
+		list(executor.map(run, range(0, rows, tile_rows)))
+	return new_img
+
 # funções que limitam valores de pixels entre 0 e 255
 # clip: limita valores entre 0 e 255, valores abaixo de 0 são 0 e valores acima de 255 são 255
 # absolute: aplicar valor absoluto a cada pixel, limitando entre 0 e 255
@@ -26,6 +252,29 @@ LIMIT_FUNCTIONS = {
 	'abs-renormalize': lambda arr: histogram_expansion(np.abs(arr))
 }
 
+# funções de limite que dependem do mínimo e do máximo da imagem inteira, com a transformação
+# aplicada antes da expansão do histograma (usado quando a imagem é processada em faixas)
+RENORMALIZE_TRANSFORMS = {
+	LIMIT_FUNCTIONS['renormalize']: lambda arr: arr,
+	LIMIT_FUNCTIONS['abs-renormalize']: np.abs
+}
+
+# nome de cada função de limite (para descrever o filtro, ver AbstractFilter.spec)
+LIMIT_NAMES = {function: name for name, function in LIMIT_FUNCTIONS.items()}
+
+def limit_name(function):
+	"""nome da função de limite em LIMIT_FUNCTIONS ou, para outra função, o nome dela com um hash
+	do código, dos valores padrão e das variáveis capturadas (para a chave de cache)"""
+	name = LIMIT_NAMES.get(function)
+	if name is not None:
+		return name
+	code = getattr(function, '__code__', None)
+	if code is None:
+		return f'custom:{function!r}'
+	digest = hashlib.sha256(marshal.dumps(code))
+	digest.update(repr((function.__defaults__, [cell.cell_contents for cell in function.__closure__ or ()])).encode())
+	return f'custom:{function.__qualname__}:{digest.hexdigest()}'
+
 @dataclass(frozen=True)
 class AbstractFilter:
 	"""classe base para filtros"""
@@ -85,10 +334,9 @@ class AbstractFilter:
 		if not isinstance(self.histogram_expansion, bool):
 			raise ValueError(f'Invalid histogram_expansion for filter {self.name}. histogram_expansion must be a boolean')
 
-	def apply(self, image_array):
-		"""aplica o filtro em uma imagem"""
-		# calcula quanto padding é necessário para aplicar o filtro
-		padding = {
+	def _padding(self):
+		"""calcula quanto padding é necessário para aplicar o filtro"""
+		return {
 			'row': {
 				'before': self.pivot[0],
 				'after': self.kernel.shape[0] - self.pivot[0] - 1
@@ -98,54 +346,190 @@ class AbstractFilter:
 				'after': self.kernel.shape[1] - self.pivot[1] - 1
 			}
 		}
-        
-        # Se o zero_extension for True, a imagem é extendida com zeros para aplicação do filtro
+
+	def _apply_area(self, image_shape, padding):
+		"""area de aplicação de filtro (por onde o pivô vai passar), nas coordenadas da imagem com padding"""
+		# Com extensão por zeros, o pivô passa por todos os pixels da imagem original
 		if self.zero_extension:
-			img_padded = np.pad(image_array,
-								((padding['row']['before'], padding['row']['after']),
-								 (padding['column']['before'], padding['column']['after']),
-								 (0, 0)),
-								'constant', constant_values=0)
-			# area de aplicação de filtro (por onde o pivô vai passar)
-			apply_area = {
+			return {
 				'row': {
 					'from': padding['row']['before'],
-					'to': padding['row']['before'] + image_array.shape[0]
+					'to': padding['row']['before'] + image_shape[0]
 				},
 				'column': {
 					'from': padding['column']['before'],
-					'to': padding['column']['before'] + image_array.shape[1]
+					'to': padding['column']['before'] + image_shape[1]
 				}
 			}
-        # Se não houver extensão por zeros, a imagem é copiada e as bordas que o pivô não pode passar são removidas
-		else:
-			img_padded = image_array.copy()
-			# area de aplicação de filtro (por onde o pivô vai passar)
-			# remove as bordas em que o pivô não consegue passar da área de aplicação
-			apply_area = {
-				'row': {
-					'from': padding['row']['before'],
-					'to': image_array.shape[0] - padding['row']['after'] 
-				},
-				'column': {
-					'from': padding['column']['before'],
-					'to': image_array.shape[1] - padding['column']['before']
-				}
+		# remove as bordas em que o pivô não consegue passar da área de aplicação
+		return {
+			'row': {
+				'from': padding['row']['before'],
+				'to': image_shape[0] - padding['row']['after'] 
+			},
+			'column': {
+				'from': padding['column']['before'],
+				'to': image_shape[1] - padding['column']['before']
 			}
+		}
+
+	def spec(self):
+		"""descrição canônica do filtro, com tudo o que muda o resultado (usada como chave de cache)"""
+		return {'kernel_shape': list(self.kernel.shape),
+				'pivot': list(self.pivot),
+				'zero_extension': self.zero_extension,
+				'limit_function': limit_name(self.limit_function),
+				'offset': self.offset,
+				'histogram_expansion': self.histogram_expansion}
+
+	def output_shape(self, height, width):
+		"""dimensões (linhas, colunas) da imagem filtrada para uma imagem de entrada height x width"""
+		apply_area = self._apply_area((height, width), self._padding())
+		return (apply_area['row']['to'] - apply_area['row']['from'],
+				apply_area['column']['to'] - apply_area['column']['from'])
+
+	def apply(self, image_array, workers=1, tile_rows=None, roi=None):
+		"""aplica o filtro em uma imagem
+		workers: número de threads; a área de aplicação é dividida em faixas de tile_rows linhas
+		roi: (x, y, largura, altura) para calcular só essa região do resultado (ver apply_region)"""
+		if roi is not None:
+			return apply_region([self], image_array, roi, workers, tile_rows)
+		with profiling.stage(self.name, 'filter', shape=list(image_array.shape)):
+			return self.finish(self.correlation(image_array, workers, tile_rows))
+
+	def correlation(self, image_array, workers=1, tile_rows=None):
+		"""resultado da correlação do filtro com a imagem, antes do offset e da função de limite"""
+		padding = self._padding()
+        
+        # Se o zero_extension for True, a imagem é extendida com zeros para aplicação do filtro
+		if self.zero_extension:
+			with profiling.stage('pad'):
+				img_padded = np.pad(image_array,
+									((padding['row']['before'], padding['row']['after']),
+									 (padding['column']['before'], padding['column']['after']),
+									 (0, 0)),
+									'constant', constant_values=0)
+        # Se não houver extensão por zeros, as bordas que o pivô não pode passar são removidas
+		# (a imagem não é modificada, então não precisa ser copiada)
+		else:
+			img_padded = image_array
+		apply_area = self._apply_area(image_array.shape, padding)
+		with profiling.stage('correlation', engine=getattr(self, 'engine', None)):
+			return self._correlate_area(img_padded, apply_area, padding, workers, tile_rows)
+
+	def finish(self, new_img):
+		"""soma o offset ao resultado da correlação, aplica a função de limite e,
+		se for o caso, a expansão de histograma (em uma passada fundida, ver epilogue)
+		new_img pode ser sobrescrito"""
+		return self.finish_float(new_img, rounding=True).astype(np.uint8)
 
+	def finish_float(self, new_img, rounding=False):
+		"""como finish, mas sem arredondar para 8 bits (modo de ponto flutuante das sequências)"""
+		with profiling.stage('epilogue', function=limit_name(self.limit_function), histogram_expansion=self.histogram_expansion):
+			if self.limit_function not in LIMIT_NAMES:
+				# função de limite fora de LIMIT_FUNCTIONS: chamada como no filtro original
+				new_img = np.asarray(self.limit_function(np.asarray(new_img, dtype=float) + self.offset), dtype=float)
+				if rounding:
+					new_img = new_img.round()
+				return epilogue(new_img, limit=None, expansion=self.histogram_expansion)
+			return epilogue(new_img, self.offset, LIMIT_NAMES[self.limit_function], self.histogram_expansion, rounding)
+
+	@property
+	def local(self):
+		"""se cada pixel do resultado depende só da vizinhança dele na imagem: o final não usa
+		o mínimo e o máximo da imagem inteira (renormalize, expansão de histograma); uma função de
+		limite fora de LIMIT_FUNCTIONS pode depender da imagem inteira, então não é local"""
+		return not self.histogram_expansion and LIMIT_NAMES.get(self.limit_function) in ('clip', 'absolute')
+
+	@property
+	def deferrable(self):
+		"""se o final do filtro (offset, limite e expansão) pode ser adiado para o fim de uma
+		sequência em ponto flutuante: sem offset, só com clip, sem expansão de histograma e com
+		um kernel em que o clip não muda nada (ver range_preserving)"""
+		return self.offset == 0 and self.limit_function is LIMIT_FUNCTIONS['clip'] and not self.histogram_expansion and self.range_preserving
+
+	@property
+	def range_preserving(self):
+		"""se a correlação de uma imagem com valores entre 0 e 255 fica sempre entre 0 e 255"""
+		return False
+
+	def stream(self, strips, workers=1, tile_rows=None):
+		"""aplica o filtro a uma imagem recebida em faixas de linhas (arrays linhas x colunas x 3)
+		e gera a imagem filtrada também em faixas; de uma faixa para a outra são guardadas
+		só as linhas do kernel - 1 que a próxima faixa precisa
+		limites que dependem da imagem inteira (renormalize, histogram_expansion) guardam o
+		resultado intermediário em um arquivo temporário e o percorrem de novo no final"""
+		if self.limit_function not in LIMIT_NAMES:
+			raise ValueError(f'Filter {self.name} has a limit function that is not in LIMIT_FUNCTIONS and can not be applied in strips')
+		correlations = self._stream_correlation(strips, workers, tile_rows)
+		transform = RENORMALIZE_TRANSFORMS.get(self.limit_function)
+		if transform is None:
+			# o limite depende só de cada pixel: a faixa inteira passa pelo final fundido
+			filtered = (epilogue(new_img, self.offset, LIMIT_NAMES[self.limit_function]).astype(np.uint8) for new_img in correlations)
+		else:
+			values = stream_histogram_expansion(transform((new_img + self.offset).astype(float)) for new_img in correlations)
+			filtered = (new_img.round().astype(np.uint8) for new_img in values)
+		if self.histogram_expansion:
+			filtered = stream_histogram_expansion(filtered)
+		yield from filtered
+
+	def _stream_correlation(self, strips, workers=1, tile_rows=None):
+		"""correlação (sem offset) de uma imagem recebida em faixas de linhas"""
+		padding = self._padding()
+		kernel_rows = self.kernel.shape[0]
+		pending = None
+		for strip in strips:
+			if self.zero_extension:
+				strip = np.pad(strip, ((0, 0), (padding['column']['before'], padding['column']['after']), (0, 0)), 'constant', constant_values=0)
+				# a primeira faixa recebe as linhas de zeros de cima
+				if pending is None:
+					pending = np.zeros((padding['row']['before'],) + strip.shape[1:], dtype=strip.dtype)
+			buffer = strip if pending is None else np.concatenate((pending, strip))
+			new_img, pending = self._correlate_rows(buffer, padding, workers, tile_rows)
+			if new_img is not None:
+				yield new_img
+		# a última faixa recebe as linhas de zeros de baixo
+		if self.zero_extension and pending is not None:
+			bottom = np.zeros((padding['row']['after'],) + pending.shape[1:], dtype=pending.dtype)
+			new_img, _ = self._correlate_rows(np.concatenate((pending, bottom)), padding, workers, tile_rows)
+			if new_img is not None:
+				yield new_img
+
+	def _correlate_rows(self, buffer, padding, workers=1, tile_rows=None):
+		"""correlação de todas as linhas de saída que cabem em buffer (já com padding)
+		retorna o resultado (ou None) e as linhas de buffer que ainda serão necessárias"""
+		rows = buffer.shape[0] - self.kernel.shape[0] + 1
+		if rows < 1:
+			return None, buffer
+		# as colunas da área de aplicação dependem só da largura da imagem original
+		width = buffer.shape[1] - (padding['column']['before'] + padding['column']['after'] if self.zero_extension else 0)
+		apply_area = self._apply_area((0, width), padding)
+		apply_area['row'] = {'from': padding['row']['before'], 'to': padding['row']['before'] + rows}
+		return self._correlate_area(buffer, apply_area, padding, workers, tile_rows), buffer[rows:]
+
+	def _correlate_area(self, img_padded, apply_area, padding, workers=1, tile_rows=None):
+		"""aplica o filtro na área de aplicação (sem offset)"""
+		# sem extensão por zeros e com o pivô à esquerda do centro, as janelas da borda direita
+		# ficam truncadas; nesse caso o filtro é aplicado pixel a pixel, como originalmente
+		if apply_area['column']['to'] + padding['column']['after'] > img_padded.shape[1]:
+			return self._correlate_per_pixel(img_padded, apply_area, padding)
+		return self._correlate(img_padded, apply_area, padding, workers, tile_rows)
+
+	def _correlate(self, img_padded, apply_area, padding, workers=1, tile_rows=None):
+		"""aplica o filtro na área de aplicação (sem offset)
+		subclasses podem sobrescrever com uma implementação vetorizada (e em paralelo)"""
+		return self._correlate_per_pixel(img_padded, apply_area, padding)
+
+	def _correlate_per_pixel(self, img_padded, apply_area, padding):
+		"""aplica o filtro pixel a pixel na área de aplicação (sem offset)"""
 		# nova imagem com as dimensões da área de aplicação
 		new_img = np.empty((apply_area['row']['to'] - apply_area['row']['from'], apply_area['column']['to'] - apply_area['column']['from'], 3))
 		# aplica o filtro para cada pixel da área de aplicação
 		for i, row in enumerate(range(apply_area['row']['from'], apply_area['row']['to'])):
 			for j, column in enumerate(range(apply_area['column']['from'], apply_area['column']['to'])):
 				# chama _filter_op para aplicar o filtro
-				new_img[i, j, :] = self._filter_op(img_padded[row - padding['row']['before']:row + padding['row']['after'] + 1, column - padding['column']['before']:column + padding['column']['after'] + 1]) + self.offset
-
-		filtered_image = self.limit_function(new_img).round().astype(np.uint8)
-		if self.histogram_expansion:
-			filtered_image = histogram_expansion(filtered_image)
-
-		return filtered_image
+				new_img[i, j, :] = self._filter_op(img_padded[row - padding['row']['before']:row + padding['row']['after'] + 1, column - padding['column']['before']:column + padding['column']['after'] + 1])
+		return new_img
 	
 	def _filter_op(self, apply_area_array):
 		"""aplica o filtro em uma área de aplicação"""
@@ -156,7 +540,9 @@ class AbstractFilter:
 @dataclass(frozen=True)
 class DataFilter(AbstractFilter):
 	"""classe para filtros definidos em um arquivo json"""
-	def from_json(path):
+	engine: str = 'auto'
+
+	def from_json(path, engine='auto'):
 		path = Path(path)
 		with path.open() as file:
 			filter_json = json.load(file)
@@ -166,30 +552,441 @@ class DataFilter(AbstractFilter):
 							  filter_json['zero_extension'],
 							  LIMIT_FUNCTIONS[filter_json['limit_function']],
 							  filter_json['offset'],
-							  filter_json['histogram_expansion'])
+							  filter_json['histogram_expansion'],
+							  engine)
+
+	def __post_init__(self):
+		super().__post_init__()
+		# Checa se o motor de correlação existe
+		if self.engine not in ENGINES:
+			raise ValueError(f'Invalid engine for filter {self.name}. Engine must be one of {", ".join(ENGINES)}')
+		# kernels de posto baixo (box, gauss, sobel...) são aplicados como passes de linha e coluna
+		object.__setattr__(self, "separable", separable_decomposition(self.kernel))
+		# kernels com pesos inteiros ou diádicos (ex: gauss3) permitem corrigir o erro da FFT
+		object.__setattr__(self, "dyadic_scale", dyadic_scale(self.kernel))
+		# e, com imagens de 8 bits, a acumulação em inteiros
+		object.__setattr__(self, "integer_plan", self._integer_plan())
+		# os passes diretos e separáveis percorrem só os elementos não nulos (ver kernel_taps)
+		object.__setattr__(self, "taps", kernel_taps(self.kernel))
+		object.__setattr__(self, "tap_index", tuple(np.array([tap[axis] for tap in self.taps], dtype=int) for axis in range(2)))
+		if self.separable is not None:
+			object.__setattr__(self, "separable_taps", [(kernel_taps(column_factor), kernel_taps(row_factor)) for column_factor, row_factor in self.separable])
+		# kernels 1x1 (ex: red.json) com final local viram uma tabela por canal
+		object.__setattr__(self, "point_table", self._point_table())
+
+	def _integer_plan(self):
+		"""pesos inteiros do kernel diádico para acumular a correlação de imagens de 8 bits em int16/int32
+		retorna None se o kernel não for diádico ou se a soma não couber em int32"""
+		if self.dyadic_scale is None:
+			return None
+		weights = np.rint(self.kernel * self.dyadic_scale).astype(np.int64)
+		# o offset só é somado depois, em float64 (ver epilogue)
+		dtype = accumulator_dtype(255 * np.max(np.sum(np.abs(weights), axis=(0, 1))))
+		if dtype is None:
+			return None
+		plan = {'scale': self.dyadic_scale, 'dtype': dtype, 'kernel': weights.astype(dtype), 'separable': None}
+		plan['taps'] = kernel_taps(plan['kernel'])
+		# o passe separável em inteiros precisa de fatores inteiros (kernel de posto 1); ele é exato,
+		# como a correlação direta, mesmo quando os fatores em float64 não são diádicos (ex: 1/3)
+		if self.separable is not None and len(self.separable) == 1:
+			factors = [integer_factors(weights[:, :, c]) for c in range(weights.shape[2])]
+			if all(factor is not None for factor in factors):
+				column_factor = np.stack([column for column, _ in factors], axis=1)
+				row_factor = np.stack([row for _, row in factors], axis=1)
+				vertical_dtype = accumulator_dtype(255 * np.max(np.sum(np.abs(column_factor), axis=0)))
+				plan['separable'] = (kernel_taps(column_factor.astype(vertical_dtype)), kernel_taps(row_factor.astype(dtype)), vertical_dtype)
+		return plan
+
+	def _point_table(self):
+		"""resultado do filtro para cada valor de 8 bits de cada canal (tabela 256 x 3)
+		retorna None se o kernel não for 1x1, se o final não for local ou com a FFT forçada"""
+		if self.kernel.shape[:2] != (1, 1) or not self.local or self.engine == 'fft':
+			return None
+		values = np.repeat(np.arange(256, dtype=np.uint8)[:, np.newaxis, np.newaxis], 3, axis=2)
+		return self.finish(self._correlate_direct(values, 256, 1))[:, 0]
+
+	def apply(self, image_array, workers=1, tile_rows=None, roi=None):
+		"""aplica o filtro em uma imagem (ver AbstractFilter.apply); os kernels 1x1 com tabela
+		(ver _point_table) aplicados a imagens de 8 bits só consultam a tabela"""
+		if self.point_table is None or roi is not None or image_array.dtype != np.uint8:
+			return super().apply(image_array, workers, tile_rows, roi)
+		with profiling.stage(self.name, 'filter', shape=list(image_array.shape), engine='point'):
+			return point_lookup(self.point_table, image_array)
+
+	def stream(self, strips, workers=1, tile_rows=None):
+		"""aplica o filtro a uma imagem recebida em faixas (ver AbstractFilter.stream)"""
+		if self.point_table is None:
+			yield from super().stream(strips, workers, tile_rows)
+			return
+		for strip in strips:
+			yield self.apply(strip, workers, tile_rows)
+
+	def spec(self):
+		"""descrição canônica do filtro: o nome do arquivo não importa, só o conteúdo do kernel
+		(o motor entra porque a FFT forçada pode mudar o arredondamento)"""
+		return dict(super().spec(),
+					kernel=hashlib.sha256(np.ascontiguousarray(self.kernel, dtype=float).tobytes()).hexdigest(),
+					engine=self.engine)
+
+	def select_engine(self, rows, columns, dtype=np.uint8):
+		"""escolhe o motor de correlação para uma área de aplicação de rows x columns pixels de uma
+		imagem dtype: o de menor custo estimado, em multiplicações por pixel, entre os exatos"""
+		# área de aplicação vazia (imagem menor que o kernel): não há o que otimizar
+		if rows < 1 or columns < 1 or (self.engine == 'separable' and self.separable is None):
+			return 'direct'
+		if self.engine != 'auto':
+			return self.engine
+
+		kernel_rows, kernel_columns = self.kernel.shape[:2]
+		integer = self.integer_plan is not None and dtype == np.uint8
+		# os passes diretos e separáveis só custam os elementos não nulos
+		costs = {'direct': len(self.taps) * (INTEGER_COST if integer else 1)}
+		# os fatores em ponto flutuante arredondam de outro jeito que a correlação direta: o auto
+		# só usa o passe separável em inteiros, que é exato
+		if integer and self.integer_plan['separable'] is not None:
+			column_taps, row_taps, _ = self.integer_plan['separable']
+			costs['separable'] = (len(column_taps) + len(row_taps)) * INTEGER_COST
+		# a FFT só é exata quando o resultado é corrigido pela escala diádica (ver _correlate_fft);
+		# nos outros casos só é usada com --engine fft
+		if self.dyadic_scale is not None and np.issubdtype(dtype, np.integer):
+			# a FFT processa blocos maiores que a saída (sobreposição de kernel - 1 pixels)
+			block_rows = fft_block_size(rows, kernel_rows)
+			block_columns = fft_block_size(columns, kernel_columns)
+			overlap = (block_rows * block_columns) / ((block_rows - kernel_rows + 1) * (block_columns - kernel_columns + 1))
+			costs['fft'] = FFT_COST * np.log2(block_rows * block_columns) * overlap
+		return min(costs, key=costs.get)
+
+	@property
+	def range_preserving(self):
+		"""pesos não negativos com soma até 1 em cada canal: cada pixel é uma média ponderada
+		(com zeros) de valores entre 0 e 255"""
+		return bool(np.all(self.kernel >= 0) and np.all(np.sum(self.kernel, axis=(0, 1)) <= 1))
 
 	def _filter_op(self, apply_area_array):
-		return np.sum(apply_area_array * self.kernel, axis=(0, 1))
+		if apply_area_array.shape != self.kernel.shape or not self.taps:
+			return np.sum(apply_area_array * self.kernel, axis=(0, 1))
+		# só os elementos não nulos, somados na mesma ordem
+		rows, columns = self.tap_index
+		return np.sum(apply_area_array[rows, columns] * self.kernel[rows, columns], axis=0)
+
+	def _correlate(self, img_padded, apply_area, padding, workers=1, tile_rows=None):
+		"""correlação vetorizada sobre toda a área de aplicação"""
+		rows = apply_area['row']['to'] - apply_area['row']['from']
+		columns = apply_area['column']['to'] - apply_area['column']['from']
+		# o motor é escolhido para a imagem inteira, não por faixa, para não mudar o resultado
+		engine = self.select_engine(rows, columns, img_padded.dtype)
+		if engine == 'fft':
+			# os blocos do overlap-save já são independentes: são eles que rodam em paralelo
+			return self._correlate_fft(img_padded, rows, columns, workers)
+		correlate = self._correlate_separable if engine == 'separable' else self._correlate_direct
+		return run_tiled(correlate, img_padded, rows, columns, self.kernel.shape[0], workers, tile_rows)
+
+	def _correlate_direct(self, img_padded, rows, columns):
+		"""desloca a imagem para cada elemento do kernel e acumula o produto,
+		em vez de percorrer a imagem pixel a pixel"""
+		if self.integer_plan is not None and img_padded.dtype == np.uint8:
+			return self._correlate_direct_integer(img_padded, rows, columns)
+		return self._accumulate_taps(img_padded, rows, columns, self.taps, np.float64)
+
+	def _accumulate_taps(self, img_padded, rows, columns, taps, dtype):
+		"""acumula o produto da imagem deslocada por cada elemento do kernel, em blocos de linhas
+		da saída que ficam no cache enquanto todos os elementos são somados"""
+		new_img = np.zeros((rows, columns, 3), dtype=dtype)
+		block = max(1, DIRECT_BLOCK_PIXELS // max(columns, 1))
+		tap = np.empty((min(block, rows), columns, 3), dtype=dtype)
+		taps = row_taps(taps, columns)
+		for start in range(0, rows, block):
+			height = min(block, rows - start)
+			accumulator, product = new_img[start:start + height], tap[:height]
+			# o pivô começa sempre em (padding before), então o elemento (a, b) do kernel
+			# corresponde à fatia da imagem que começa em (a, b)
+			# acumula na mesma ordem que np.sum(..., axis=(0, 1)) para manter o resultado idêntico
+			for a, b, weight in taps:
+				np.multiply(img_padded[start + a:start + a + height, b:b + columns], weight, out=product)
+				accumulator += product
+		return new_img
+
+	def _correlate_direct_integer(self, img_padded, rows, columns):
+		"""correlação direta acumulada em inteiros a partir da imagem de 8 bits"""
+		plan = self.integer_plan
+		new_img = self._accumulate_taps(img_padded, rows, columns, plan['taps'], plan['dtype'])
+		return new_img if plan['scale'] == 1 else new_img / plan['scale']
+
+	def _correlate_separable(self, img_padded, rows, columns):
+		"""aplica cada termo da decomposição como um passe vertical (fator coluna)
+		seguido de um passe horizontal (fator linha): O(m + n) por pixel em vez de O(m * n)"""
+		if self.integer_plan is not None and self.integer_plan['separable'] is not None and img_padded.dtype == np.uint8:
+			return self._correlate_separable_integer(img_padded, rows, columns)
+		new_img = np.zeros((rows, columns, 3))
+		vertical = np.empty((rows, img_padded.shape[1], 3))
+		tap = np.empty((rows, img_padded.shape[1], 3))
+		for column_taps, row_taps in self.separable_taps:
+			vertical[:] = 0
+			for a, weight in column_taps:
+				np.multiply(img_padded[a:a + rows], weight, out=tap)
+				vertical += tap
+			for b, weight in row_taps:
+				np.multiply(vertical[:, b:b + columns], weight, out=tap[:, :columns])
+				new_img += tap[:, :columns]
+		return new_img
+
+	def _correlate_separable_integer(self, img_padded, rows, columns):
+		"""passes vertical e horizontal acumulados em inteiros a partir da imagem de 8 bits"""
+		plan = self.integer_plan
+		column_taps, row_taps, vertical_dtype = plan['separable']
+		vertical = np.zeros((rows, img_padded.shape[1], 3), dtype=vertical_dtype)
+		tap = np.empty_like(vertical)
+		for a, weight in column_taps:
+			np.multiply(img_padded[a:a + rows], weight, out=tap)
+			vertical += tap
+		new_img = np.zeros((rows, columns, 3), dtype=np.promote_types(vertical_dtype, plan['dtype']))
+		tap = np.empty_like(new_img)
+		for b, weight in row_taps:
+			np.multiply(vertical[:, b:b + columns], weight, out=tap)
+			new_img += tap
+		return new_img if plan['scale'] == 1 else new_img / plan['scale']
+
+	def _correlate_fft(self, img_padded, rows, columns, workers=1):
+		"""correlação via FFT com overlap-save: a imagem é processada em blocos que se
+		sobrepõem em (kernel - 1) pixels, e só a parte sem efeito circular é aproveitada"""
+		kernel_rows, kernel_columns = self.kernel.shape[:2]
+		block_rows = fft_block_size(rows, kernel_rows)
+		block_columns = fft_block_size(columns, kernel_columns)
+		# pixels de saída válidos por bloco
+		step_rows = block_rows - kernel_rows + 1
+		step_columns = block_columns - kernel_columns + 1
+		# correlação = convolução com o kernel espelhado
+		kernel_fft = np.fft.rfft2(self.kernel[::-1, ::-1], s=(block_rows, block_columns), axes=(0, 1))
+		new_img = np.empty((rows, columns, 3))
+
+		def correlate_block(origin):
+			row, column = origin
+			block = img_padded[row:row + block_rows, column:column + block_columns]
+			block_fft = np.fft.rfft2(block, s=(block_rows, block_columns), axes=(0, 1))
+			result = np.fft.irfft2(block_fft * kernel_fft, s=(block_rows, block_columns), axes=(0, 1))
+			height = min(step_rows, rows - row)
+			width = min(step_columns, columns - column)
+			new_img[row:row + height, column:column + width] = result[kernel_rows - 1:kernel_rows - 1 + height, kernel_columns - 1:kernel_columns - 1 + width]
+
+		origins = [(row, column) for row in range(0, rows, step_rows) for column in range(0, columns, step_columns)]
+		with ThreadPoolExecutor(max(workers, 1)) as executor:
+			list(executor.map(correlate_block, origins))
+		# com imagem inteira e kernel diádico o resultado exato é múltiplo de 1 / escala:
+		# arredonda para esse múltiplo, removendo o erro de arredondamento da FFT
+		if self.dyadic_scale is not None and np.issubdtype(img_padded.dtype, np.integer):
+			new_img *= self.dyadic_scale
+			np.rint(new_img, out=new_img)
+			new_img /= self.dyadic_scale
+		else:
+			np.round(new_img, FFT_DECIMALS, out=new_img)
+		return new_img
 
 
 @dataclass(frozen=True, init=False)
 class FunctionFilter(AbstractFilter):
 	"""classe para filtros definidos por uma função"""
 	func: callable
+	# versão opcional de func que processa a imagem inteira de uma vez
+	# recebe (imagem com padding, linhas, colunas, (linhas da janela, colunas da janela))
+	image_func: callable = None
 
-	def __init__(self, name, rows, columns, pivot, zero_extension, func):
+	def __init__(self, name, rows, columns, pivot, zero_extension, func, image_func=None):
 		super().__init__(name, np.empty((rows, columns, 3)), pivot, zero_extension, LIMIT_FUNCTIONS['clip'], offset=0, histogram_expansion=False)
 		object.__setattr__(self, "func", func)
+		object.__setattr__(self, "image_func", image_func)
 
 	def _filter_op(self, apply_area_array):
 		return self.func(apply_area_array)
 
+	def spec(self):
+		"""descrição canônica do filtro: a função é identificada pelo nome ([median], [box]...)"""
+		return dict(super().spec(), function=self.name)
+
+	def _correlate(self, img_padded, apply_area, padding, workers=1, tile_rows=None):
+		# sem versão para a imagem inteira, aplica func pixel a pixel
+		if self.image_func is None:
+			return self._correlate_per_pixel(img_padded, apply_area, padding)
+		rows = apply_area['row']['to'] - apply_area['row']['from']
+		columns = apply_area['column']['to'] - apply_area['column']['from']
+		# área de aplicação vazia (ou negativa, que gera erro como na aplicação pixel a pixel):
+		# tratada aqui para todas as funções image_func
+		if rows < 1 or columns < 1:
+			return np.empty((rows, columns, 3))
+		window = self.kernel.shape[:2]
+		return run_tiled(lambda img, rows, columns: self.image_func(img, rows, columns, window),
+						 img_padded, rows, columns, window[0], workers, tile_rows)
+
+
+def box_mean(img_padded, rows, columns, window):
+	"""média de cada janela pela imagem integral, com quatro acessos por pixel"""
+	window_rows, window_columns = window
+	# somas acumuladas de ponto flutuante teriam erro de arredondamento diferente do de np.mean
+	if not np.issubdtype(img_padded.dtype, np.integer):
+		windows = np.lib.stride_tricks.sliding_window_view(img_padded, window, axis=(0, 1))
+		return np.mean(windows[:rows, :columns], axis=(-2, -1))
+	# com imagem inteira as somas são exatas, e a média fica idêntica à de np.mean
+	integral = np.zeros((img_padded.shape[0] + 1, img_padded.shape[1] + 1, img_padded.shape[2]), dtype=np.int64)
+	np.cumsum(img_padded, axis=0, dtype=np.int64, out=integral[1:, 1:])
+	np.cumsum(integral[1:, 1:], axis=1, out=integral[1:, 1:])
+	window_sum = (integral[window_rows:window_rows + rows, window_columns:window_columns + columns]
+				  - integral[:rows, window_columns:window_columns + columns]
+				  - integral[window_rows:window_rows + rows, :columns]
+				  + integral[:rows, :columns])
+	return window_sum / (window_rows * window_columns)
+
+# a partir desta largura de janela, os histogramas deslizantes são obtidos de histogramas por
+# coluna (custo constante por pixel) em vez de atualizados pixel a pixel da janela
+HISTOGRAM_COLUMNS_MIN_WIDTH = 28
+
+def sliding_histograms(img_padded, rows, columns, window):
+	"""percorre as linhas da área de aplicação mantendo o histograma de 256 níveis de cada janela
+	(algoritmo de Huang, vetorizado sobre todas as colunas): a cada linha, retira os pixels da linha
+	que sai da janela e soma os da linha que entra, com custo proporcional à largura da janela
+	gera, para cada linha, os histogramas finos (colunas, bandas, 256) e grossos (colunas, bandas, 16)"""
+	window_rows, window_columns = window
+	if window_columns >= HISTOGRAM_COLUMNS_MIN_WIDTH:
+		yield from _column_sliding_histograms(img_padded, rows, columns, window)
+		return
+	bands = img_padded.shape[2]
+	histogram = np.zeros((columns, bands, 256), dtype=np.int32)
+	coarse = np.zeros((columns, bands, 16), dtype=np.int32)
+	column_index = np.arange(columns)[:, np.newaxis]
+	band_index = np.arange(bands)[np.newaxis, :]
+
+	def update(row, delta):
+		for b in range(window_columns):
+			# em cada deslocamento b, cada janela recebe exatamente um pixel por banda
+			values = img_padded[row, b:b + columns]
+			histogram[column_index, band_index, values] += delta
+			coarse[column_index, band_index, values >> 4] += delta
+
+	for a in range(window_rows):
+		update(a, 1)
+	for row in range(rows):
+		if row > 0:
+			update(row - 1, -1)
+			update(row + window_rows - 1, 1)
+		yield histogram, coarse
+
+def _column_sliding_histograms(img_padded, rows, columns, window):
+	"""variante de custo constante de sliding_histograms (Perreault e Hébert): mantém um histograma
+	por coluna da imagem, atualizado com um pixel por coluna a cada linha, e obtém o histograma de
+	cada janela como a soma acumulada desses histogramas ao longo das colunas"""
+	window_rows, window_columns = window
+	image_columns, bands = img_padded.shape[1:]
+	column_histogram = np.zeros((image_columns, bands, 256), dtype=np.int32)
+	column_coarse = np.zeros((image_columns, bands, 16), dtype=np.int32)
+	# somas acumuladas com uma linha de zeros no início
+	running = np.zeros((image_columns + 1, bands, 256), dtype=np.int32)
+	running_coarse = np.zeros((image_columns + 1, bands, 16), dtype=np.int32)
+	column_index = np.arange(image_columns)[:, np.newaxis]
+	band_index = np.arange(bands)[np.newaxis, :]
+
+	def update(row, delta):
+		values = img_padded[row]
+		column_histogram[column_index, band_index, values] += delta
+		column_coarse[column_index, band_index, values >> 4] += delta
+
+	for a in range(window_rows):
+		update(a, 1)
+	for row in range(rows):
+		if row > 0:
+			update(row - 1, -1)
+			update(row + window_rows - 1, 1)
+		np.cumsum(column_histogram, axis=0, out=running[1:])
+		np.cumsum(column_coarse, axis=0, out=running_coarse[1:])
+		yield (running[window_columns:window_columns + columns] - running[:columns],
+			   running_coarse[window_columns:window_columns + columns] - running_coarse[:columns])
+
+def histogram_rank(histogram, coarse, rank):
+	"""valor de ordem rank (a partir de 0) de cada janela: o histograma grosso localiza o
+	bloco de 16 níveis que contém o valor, e só esse bloco do histograma fino é percorrido"""
+	coarse_cumsum = np.cumsum(coarse, axis=-1)
+	coarse_bin = np.sum(coarse_cumsum <= rank, axis=-1)[..., np.newaxis]
+	# quantidade de valores nos blocos anteriores ao bloco encontrado
+	before = np.take_along_axis(coarse_cumsum - coarse, coarse_bin, axis=-1)
+	fine = np.take_along_axis(histogram, coarse_bin * 16 + np.arange(16), axis=-1)
+	fine_bin = np.sum(np.cumsum(fine, axis=-1) <= rank - before, axis=-1)
+	return coarse_bin[..., 0] * 16 + fine_bin
+
+def histogram_median(img_padded, rows, columns, window):
+	"""mediana de cada janela por histogramas deslizantes (média dos centrais se par, como np.median)"""
+	# imagens que não são de 8 bits não cabem nos histogramas de 256 níveis
+	if img_padded.dtype != np.uint8:
+		windows = np.lib.stride_tricks.sliding_window_view(img_padded, window, axis=(0, 1))
+		return np.median(windows[:rows, :columns], axis=(-2, -1))
+	# o custo por pixel é proporcional à largura da janela: desliza pela menor dimensão
+	if window[1] > window[0]:
+		return histogram_median(img_padded.transpose(1, 0, 2), columns, rows, window[::-1]).transpose(1, 0, 2)
+
+	size = window[0] * window[1]
+	new_img = np.empty((rows, columns, img_padded.shape[2]))
+	for row, (histogram, coarse) in enumerate(sliding_histograms(img_padded, rows, columns, window)):
+		lower = histogram_rank(histogram, coarse, (size - 1) // 2)
+		upper = histogram_rank(histogram, coarse, size // 2) if size % 2 == 0 else lower
+		new_img[row] = (lower + upper) / 2
+	return new_img
+
+def histogram_mode(img_padded, rows, columns, window):
+	"""moda de cada janela por histogramas deslizantes (no empate, a primeira, como statistics.mode)"""
+	if img_padded.dtype != np.uint8:
+		windows = np.lib.stride_tricks.sliding_window_view(img_padded, window, axis=(0, 1))[:rows, :columns]
+		return np.array([[[stats.mode(band.flatten()) for band in pixel] for pixel in row] for row in windows], dtype=np.float64)
+
+	window_rows, window_columns = window
+	new_img = np.empty((rows, columns, img_padded.shape[2]))
+	for row, (histogram, _) in enumerate(sliding_histograms(img_padded, rows, columns, window)):
+		counts = histogram.max(axis=-1)
+		is_mode = histogram == counts[..., np.newaxis]
+		# sem empate, a moda é o único nível com a contagem máxima
+		new_img[row] = np.argmax(is_mode, axis=-1)
+		tied_columns, tied_bands = np.nonzero(np.sum(is_mode, axis=-1) > 1)
+		# com empate, percorre a janela linha a linha até achar o primeiro valor que é moda
+		pending = np.ones(len(tied_columns), dtype=bool)
+		for a in range(window_rows):
+			for b in range(window_columns):
+				if not pending.any():
+					break
+				values = img_padded[row + a, tied_columns + b, tied_bands]
+				found = pending & is_mode[tied_columns, tied_bands, values]
+				new_img[row, tied_columns[found], tied_bands[found]] = values[found]
+				pending &= ~found
+	return new_img
+
+def van_herk_gil_werman(array, size, axis, operation):
+	"""mínimo (operation=np.minimum) ou máximo (np.maximum) de cada janela de tamanho size ao
+	longo de axis, pelo algoritmo de van Herk/Gil-Werman: o eixo é dividido em blocos de size
+	elementos, com acumulados do início ao fim e do fim ao início de cada bloco, e cada janela
+	(que cobre no máximo dois blocos) combina um valor de cada acumulado"""
+	array = np.moveaxis(array, axis, 0)
+	length = array.shape[0]
+	blocks = -(-length // size)
+	# completa o último bloco com o elemento neutro da operação
+	limits = np.iinfo(array.dtype) if np.issubdtype(array.dtype, np.integer) else np.finfo(array.dtype)
+	neutral = limits.max if operation is np.minimum else limits.min
+	padded = np.full((blocks * size,) + array.shape[1:], neutral, dtype=array.dtype)
+	padded[:length] = array
+	padded = padded.reshape((blocks, size) + array.shape[1:])
+	forward = operation.accumulate(padded, axis=1).reshape((-1,) + array.shape[1:])
+	backward = operation.accumulate(padded[:, ::-1], axis=1)[:, ::-1].reshape((-1,) + array.shape[1:])
+	windows = length - size + 1
+	return np.moveaxis(operation(backward[:windows], forward[size - 1:size - 1 + windows]), 0, axis)
+
+def morphology(operation):
+	"""erosão (np.minimum) ou dilatação (np.maximum) por van Herk/Gil-Werman nas linhas e nas colunas"""
+	def image_func(img_padded, rows, columns, window):
+		window_rows, window_columns = window
+		result = van_herk_gil_werman(img_padded[:rows + window_rows - 1, :columns + window_columns - 1], window_rows, 0, operation)
+		result = van_herk_gil_werman(result, window_columns, 1, operation)
+		return result.astype(np.float64)
+	return image_func
+
 # Definindo alguns filtros que serão utilizados posteriormente
-BOX_FILTER = partial(FunctionFilter, '[box]', func=lambda array: np.array([np.mean(array[:,:,band]) for band in range(array.shape[2])]))
-MEDIAN_FILTER = partial(FunctionFilter, '[median]', func=lambda array: np.array([np.median(array[:,:,band]) for band in range(array.shape[2])]))
-MODE_FILTER = partial(FunctionFilter, '[mode]', func=lambda array: np.array([stats.mode(array[:,:,band].flatten()) for band in range(array.shape[2])]))
-ERODE_FILTER = partial(FunctionFilter, '[erode]', func=lambda array: np.array([np.min(array[:,:,band]) for band in range(array.shape[2])]))
-DILATE_FILTER = partial(FunctionFilter, '[dilate]', func=lambda array: np.array([np.max(array[:,:,band]) for band in range(array.shape[2])]))
+BOX_FILTER = partial(FunctionFilter, '[box]', func=lambda array: np.array([np.mean(array[:,:,band]) for band in range(array.shape[2])]), image_func=box_mean)
+MEDIAN_FILTER = partial(FunctionFilter, '[median]', func=lambda array: np.array([np.median(array[:,:,band]) for band in range(array.shape[2])]), image_func=histogram_median)
+MODE_FILTER = partial(FunctionFilter, '[mode]', func=lambda array: np.array([stats.mode(array[:,:,band].flatten()) for band in range(array.shape[2])]), image_func=histogram_mode)
+ERODE_FILTER = partial(FunctionFilter, '[erode]', func=lambda array: np.array([np.min(array[:,:,band]) for band in range(array.shape[2])]), image_func=morphology(np.minimum))
+DILATE_FILTER = partial(FunctionFilter, '[dilate]', func=lambda array: np.array([np.max(array[:,:,band]) for band in range(array.shape[2])]), image_func=morphology(np.maximum))
 
 # Cria um dicionário que associa uma string (nome do filtro) com uma função de filtro correspondente
 FUNCTIONS_FILTER_TABLE = {
@@ -232,3 +1029,268 @@ def get_function_filter(filter_str):
     
     # Retorna o filtro correspondente à string passada como parâmetro
 	return FUNCTIONS_FILTER_TABLE[name](rows, columns, pivot, zero_extension)
+
+def load_filter(filter_str, engine='auto'):
+	"""carrega um filtro a partir da linha de comando: um filtro de função entre colchetes ou um arquivo json"""
+	if filter_str[0] == '[' and filter_str[-1] == ']': # Se o elemento for uma string delimitada por colchetes [ e ], ele é tratado como uma função definida pelo usuário
+		return get_function_filter(filter_str)
+	# Caso contrário, considera que é um filtro em formato JSON e utiliza o método from_json para obter a instância do filtro
+	return DataFilter.from_json(filter_str, engine)
+
+def compose_filters(filters):
+	"""compõe uma sequência de DataFilter (sem os limites intermediários) em um único filtro:
+	correlacionar com A e depois com B equivale a correlacionar com a convolução completa de A e B,
+	com o pivô na soma dos pivôs; o final (offset, limite e expansão) é o do último filtro"""
+	kernel = filters[0].kernel.astype(float)
+	for next_filter in filters[1:]:
+		composed = np.zeros((kernel.shape[0] + next_filter.kernel.shape[0] - 1, kernel.shape[1] + next_filter.kernel.shape[1] - 1, 3))
+		for (i, j), _ in np.ndenumerate(next_filter.kernel[:, :, 0]):
+			composed[i:i + kernel.shape[0], j:j + kernel.shape[1]] += kernel * next_filter.kernel[i, j]
+		kernel = composed
+	last = filters[-1]
+	return DataFilter('+'.join(f.name for f in filters),
+					  kernel,
+					  (sum(f.pivot[0] for f in filters), sum(f.pivot[1] for f in filters)),
+					  last.zero_extension,
+					  last.limit_function,
+					  last.offset,
+					  last.histogram_expansion,
+					  last.engine)
+
+def _fusible(first, second):
+	"""se dois DataFilter seguidos de uma sequência em ponto flutuante podem ser compostos
+	sem mudar o resultado: o primeiro não tem final próprio, os dois usam a mesma extensão e,
+	sem extensão por zeros, nenhum tem janelas truncadas na borda direita"""
+	if not first.deferrable or first.zero_extension != second.zero_extension:
+		return False
+	if first.zero_extension:
+		return True
+	padding = [f._padding()['column'] for f in (first, second)]
+	return all(p['before'] >= p['after'] for p in padding)
+
+def correlate_fused(filters, image_array, workers=1, tile_rows=None):
+	"""correlação em ponto flutuante de uma sequência de DataFilter compostos em uma só passada"""
+	new_img = compose_filters(filters).correlation(image_array, workers, tile_rows)
+	if len(filters) == 1 or not filters[0].zero_extension:
+		return new_img
+
+	# o kernel composto não vê os zeros de fora das imagens intermediárias: as bordas ao alcance
+	# dos filtros seguintes ao primeiro são recalculadas filtro a filtro, em sub-imagens
+	def sequential(sub_image):
+		for f in filters:
+			sub_image = f.correlation(sub_image)
+		return sub_image
+
+	padding = [f._padding() for f in filters]
+	for axis, name in enumerate(('row', 'column')):
+		# tamanho das faixas da borda e alcance de todos os filtros antes e depois do pivô
+		border_before = sum(p[name]['before'] for p in padding[1:])
+		border_after = sum(p[name]['after'] for p in padding[1:])
+		reach_before = sum(p[name]['before'] for p in padding)
+		reach_after = sum(p[name]['after'] for p in padding)
+		size = image_array.shape[axis]
+		# cada sub-imagem começa na borda real e vai até onde a faixa ainda depende dela;
+		# pares (linhas ou colunas da sub-imagem, faixa mantida dentro da sub-imagem)
+		strips = []
+		if border_before:
+			strips.append((slice(0, min(size, border_before + reach_after)), slice(0, min(size, border_before))))
+		if border_after:
+			start = max(0, size - border_after - reach_before)
+			strips.append((slice(start, size), slice(max(0, size - border_after) - start, size - start)))
+		before_axis = (slice(None),) * axis
+		for source, kept in strips:
+			sub_img = sequential(image_array[before_axis + (source,)])
+			new_img[before_axis + (slice(source.start + kept.start, source.start + kept.stop),)] = sub_img[before_axis + (kept,)]
+	return new_img
+
+def apply_sequence(filters, image_array, workers=1, tile_rows=None, float_pipeline=False, roi=None):
+	"""aplica uma sequência de filtros, um após o outro
+	float_pipeline: os resultados intermediários dos DataFilter seguidos ficam em ponto flutuante,
+	sem arredondar para 8 bits; os filtros sem final próprio (ver AbstractFilter.deferrable)
+	são compostos com o seguinte e aplicados em uma só passada (ver compose_filters)
+	roi: (x, y, largura, altura) para calcular só essa região do resultado (ver apply_region)"""
+	if roi is not None:
+		return apply_region(filters, image_array, roi, workers, tile_rows, float_pipeline)
+	if not float_pipeline:
+		for f in filters:
+			image_array = f.apply(image_array, workers, tile_rows)
+		return image_array
+
+	# agrupa os DataFilter seguidos que podem ser compostos
+	groups = []
+	for f in filters:
+		if groups and isinstance(f, DataFilter) and isinstance(groups[-1][-1], DataFilter) and _fusible(groups[-1][-1], f):
+			groups[-1].append(f)
+		else:
+			groups.append([f])
+
+	for index, group in enumerate(groups):
+		last = group[-1]
+		if not isinstance(last, DataFilter):
+			# os filtros de função não são lineares: recebem a imagem em 8 bits
+			image_array = last.apply(image_array, workers, tile_rows)
+			continue
+		with profiling.stage('+'.join(f.name for f in group), 'filter', shape=list(image_array.shape)):
+			new_img = correlate_fused(group, image_array, workers, tile_rows)
+			# o resultado só é arredondado antes de um filtro de função ou no fim da sequência
+			if index + 1 < len(groups) and isinstance(groups[index + 1][0], DataFilter):
+				image_array = new_img if last.deferrable else last.finish_float(new_img)
+			else:
+				image_array = last.finish(new_img)
+	return image_array
+
+def sequence_shapes(filters, shape):
+	"""dimensões (linhas, colunas) da imagem de entrada e do resultado de cada filtro da sequência"""
+	shapes = [tuple(shape[:2])]
+	for f in filters:
+		shapes.append(f.output_shape(*shapes[-1]))
+	return shapes
+
+def _input_interval(f, interval, size, axis):
+	"""intervalo [início, fim) da entrada de f (com size pixels no eixo 'row' ou 'column') de que
+	depende o intervalo da saída; as posições da entrada e da saída coincidem: com extensão por
+	zeros a saída i é a do pivô na entrada i, sem extensão é a da janela que começa na entrada i"""
+	start, stop = interval
+	padding = f._padding()[axis]
+	if f.zero_extension:
+		return max(0, start - padding['before']), min(size, stop + padding['after'])
+	# sem extensão, a área de aplicação das colunas termina 'before' colunas antes da borda (ver _apply_area)
+	after = padding['after'] if axis == 'row' else max(padding['before'], padding['after'])
+	return start, min(size, stop + padding['before'] + after)
+
+def sequence_region(filters, shape, roi):
+	"""região da imagem de entrada (de dimensões shape) de que depende a região roi = (x, y, largura,
+	altura) do resultado da sequência de filtros, como intervalos [início, fim) de (linhas, colunas)
+	do último filtro para o primeiro, cada um amplia a região pelo alcance do kernel em volta do
+	pivô (o halo), sem passar das bordas; os filtros cujo final não é local precisam da imagem inteira"""
+	shapes = sequence_shapes(filters, shape)
+	x, y, width, height = roi
+	if width < 1 or height < 1 or x < 0 or y < 0 or x + width > shapes[-1][1] or y + height > shapes[-1][0]:
+		raise ValueError(f'Region of interest {tuple(roi)} is outside the {shapes[-1][1]}x{shapes[-1][0]} result of {[f.name for f in filters]}')
+	rows, columns = (y, y + height), (x, x + width)
+	for f, (size_rows, size_columns) in zip(reversed(filters), reversed(shapes[:-1])):
+		if f.local:
+			rows, columns = _input_interval(f, rows, size_rows, 'row'), _input_interval(f, columns, size_columns, 'column')
+		else:
+			rows, columns = (0, size_rows), (0, size_columns)
+	return rows, columns
+
+def _full_image_engine(f, output_shape, dtype):
+	"""f com o motor escolhido para o resultado inteiro, não para a região (ver DataFilter.select_engine)"""
+	if not isinstance(f, DataFilter):
+		return f
+	engine = f.select_engine(*output_shape, dtype)
+	return f if engine == f.engine else replace(f, engine=engine)
+
+def apply_region(filters, image_array, roi, workers=1, tile_rows=None, float_pipeline=False, origin=(0, 0), shape=None):
+	"""aplica uma sequência de filtros calculando só a região roi = (x, y, largura, altura) do resultado
+	image_array pode ser só a parte, começando em origin = (linha, coluna), de uma imagem de dimensões shape"""
+	shape = tuple(shape or image_array.shape[:2])
+	rows, columns = sequence_region(filters, shape, roi)
+	if (rows[0] < origin[0] or columns[0] < origin[1]
+			or rows[1] > origin[0] + image_array.shape[0] or columns[1] > origin[1] + image_array.shape[1]):
+		raise ValueError(f'Image part at {tuple(origin)} does not contain the input region {rows}, {columns} of {[f.name for f in filters]}')
+	image_array = image_array[rows[0] - origin[0]:rows[1] - origin[0], columns[0] - origin[1]:columns[1] - origin[1]]
+	# os filtros até o último de final não local recebem a imagem inteira, e o resto da sequência
+	# é aplicado só à região necessária do resultado deles (em ponto flutuante os resultados
+	# intermediários não são arredondados, então a sequência é aplicada inteira à região)
+	split = max((index + 1 for index, f in enumerate(filters) if not f.local), default=0)
+	if split and not float_pipeline:
+		image_array = apply_sequence(filters[:split], image_array, workers, tile_rows)
+		return apply_region(filters[split:], image_array, roi, workers, tile_rows)
+	# cada filtro recebe a imagem de 8 bits, a não ser um DataFilter depois de outro em ponto flutuante
+	dtypes = [image_array.dtype] + [float if float_pipeline and isinstance(f, DataFilter) and isinstance(g, DataFilter) else np.uint8 for f, g in zip(filters, filters[1:])]
+	pinned = [_full_image_engine(f, output_shape, dtype) for f, output_shape, dtype in zip(filters, sequence_shapes(filters, shape)[1:], dtypes)]
+	x, y, width, height = roi
+	result = apply_sequence(pinned, image_array, workers, tile_rows, float_pipeline)
+	return result[y - rows[0]:y - rows[0] + height, x - columns[0]:x - columns[0] + width]
+
+# linhas da saída processadas de cada vez pelo somatório de filtros (ver apply_sum)
+SUM_TILE_ROWS = 64
+
+def merge_filters(filters):
+	"""soma os kernels de DataFilter com a mesma extensão em um único filtro, cuja correlação
+	é a soma das correlações: com extensão por zeros os kernels são alinhados pelo pivô,
+	sem extensão pelo canto superior esquerdo da janela (a primeira linha e coluna da saída)"""
+	padding = [f._padding() for f in filters]
+	if filters[0].zero_extension:
+		pivot = tuple(max(p[axis]['before'] for p in padding) for axis in ('row', 'column'))
+		after = tuple(max(p[axis]['after'] for p in padding) for axis in ('row', 'column'))
+		shape = (pivot[0] + after[0] + 1, pivot[1] + after[1] + 1, 3)
+		corners = [(pivot[0] - p['row']['before'], pivot[1] - p['column']['before']) for p in padding]
+	else:
+		pivot = filters[0].pivot
+		shape = (max(f.kernel.shape[0] for f in filters), max(f.kernel.shape[1] for f in filters), 3)
+		corners = [(0, 0)] * len(filters)
+	kernel = np.zeros(shape)
+	for f, (row, column) in zip(filters, corners):
+		kernel[row:row + f.kernel.shape[0], column:column + f.kernel.shape[1]] += f.kernel
+	first = filters[0]
+	return DataFilter('+'.join(f.name for f in filters), kernel, pivot, first.zero_extension, first.limit_function, 0, False, first.engine)
+
+def apply_sum(filters, image_array, workers=1, tile_rows=None, float_pipeline=False):
+	"""aplica vários filtros à imagem, faixa a faixa, soma os resultados sem transbordar e expande o histograma da soma
+	com float_pipeline, os resultados não são arredondados antes da soma"""
+	height, width = image_array.shape[:2]
+	shapes = {f.output_shape(height, width) for f in filters}
+	if len(shapes) > 1:
+		raise ValueError(f'Filters in filter sum {[f.name for f in filters]} produce images of different sizes')
+	rows, columns = shapes.pop()
+
+	# filtros combinados, agrupados pela extensão; sem extensão, as janelas truncadas ficam de fora
+	groups = {}
+	stages = []
+	for f in filters:
+		padding = f._padding()['column']
+		if float_pipeline and isinstance(f, DataFilter) and f.deferrable and (f.zero_extension or padding['before'] >= padding['after']):
+			groups.setdefault(f.zero_extension, []).append(f)
+		else:
+			stages.append(f)
+	unrounded = float_pipeline and any(isinstance(f, DataFilter) and f.local for f in stages)
+	accumulator = np.zeros((rows, columns, 3), dtype=float if groups or unrounded else np.int32)
+
+	# pares (filtro, final) aplicados faixa a faixa; os combinados não têm final
+	tiled = [(merge_filters(group) if len(group) > 1 else group[0], lambda new_img: new_img) for group in groups.values()]
+	for f in stages:
+		if not f.local:
+			accumulator += f.apply(image_array, workers, tile_rows)
+		elif float_pipeline and isinstance(f, DataFilter):
+			tiled.append((f, f.finish_float))
+		else:
+			tiled.append((f, f.finish))
+	for index, (f, finish) in enumerate(tiled):
+		if isinstance(f, DataFilter):
+			# o motor é escolhido para a imagem inteira, para o resultado não depender das faixas
+			engine = f.select_engine(rows, columns, image_array.dtype)
+			if engine == 'fft':
+				accumulator += finish(f.correlation(image_array, workers))
+				tiled[index] = None
+			elif engine != f.engine:
+				tiled[index] = (replace(f, engine=engine), finish)
+	tiled = [stage for stage in tiled if stage is not None]
+	if not tiled or rows < 1 or columns < 1:
+		return epilogue(accumulator, limit=None, expansion=True).astype(np.uint8)
+
+	paddings = [f._padding() for f, _ in tiled]
+	before = {axis: max(p[axis]['before'] for p in paddings) for axis in ('row', 'column')}
+	after = {axis: max(p[axis]['after'] for p in paddings) for axis in ('row', 'column')}
+	# uma única cópia da imagem com o maior padding, compartilhada pelos filtros com extensão por zeros
+	if any(f.zero_extension for f, _ in tiled):
+		img_padded = np.pad(image_array, ((before['row'], after['row']), (before['column'], after['column']), (0, 0)), 'constant', constant_values=0)
+	tile_rows = tile_rows or SUM_TILE_ROWS
+
+	def run(start):
+		stop = min(rows, start + tile_rows)
+		for (f, finish), padding in zip(tiled, paddings):
+			if f.zero_extension:
+				buffer = img_padded[start + before['row'] - padding['row']['before']:stop + before['row'] + padding['row']['after'],
+									before['column'] - padding['column']['before']:before['column'] + width + padding['column']['after']]
+			else:
+				buffer = image_array[start:stop + f.kernel.shape[0] - 1]
+			new_img, _ = f._correlate_rows(buffer, padding)
+			accumulator[start:stop] += finish(new_img)
+
+	with profiling.stage('+'.join(f.name for f, _ in tiled), 'filter', shape=list(image_array.shape)), ThreadPoolExecutor(max(workers, 1)) as executor:
+		list(executor.map(run, range(0, rows, tile_rows)))
+	with profiling.stage('histogram expansion'):
+		return epilogue(accumulator, limit=None, expansion=True).astype(np.uint8)
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import itertools
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from PIL import Image, ImageSequence, TiffImagePlugin
+
+import pipeline
+import profiling
+
+# Modo de quadros (opção --frames do src/main.py): aplica as operações a cada quadro de um GIF
+# animado, de um TIFF de várias páginas (ou de outro formato com vários quadros) ou de uma
+# sequência de arquivos numerados. A decodificação, os filtros e a codificação rodam ao mesmo tempo,
+# cada um em uma thread, ligados por filas de poucos quadros; os filtros são carregados uma só vez.
+
+# quadros esperando em cada fila entre as etapas
+DEFAULT_QUEUE_FRAMES = 4
+
+
+def is_sequence(path):
+    """o caminho é um padrão de sequência numerada, no formato do printf (ex: quadros/%04d.png)"""
+    return '%' in Path(path).name
+
+
+def sequence_paths(pattern, start=None):
+    """caminhos dos quadros de uma sequência numerada, do número start (ou 0, ou 1 se não houver
+    o quadro 0) até o primeiro número que não existir"""
+    if start is None:
+        start = 0 if os.path.exists(pattern % 0) else 1
+    paths = []
+    while os.path.exists(pattern % (start + len(paths))):
+        paths.append(pattern % (start + len(paths)))
+    return paths
+
+
+def read_frames(path, grayscale=False, start=None):
+    """gera (caminho do quadro, informações do quadro, array RGB) de cada quadro da entrada"""
+    if is_sequence(path):
+        for index, frame_path in enumerate(sequence_paths(path, start)):
+            with Image.open(frame_path) as img:
+                yield frame_path, {}, pipeline.decode(img, grayscale, frame=index)
+        return
+    with Image.open(path) as img:
+        for index, frame in enumerate(ImageSequence.Iterator(img)):
+            yield path, dict(frame.info), pipeline.decode(frame, grayscale, frame=index)
+
+
+def output_format(path):
+    """formato do PIL em que os resultados da entrada são gravados (o da extensão do arquivo)"""
+    Image.init()
+    return Image.registered_extensions().get(Path(path).suffix.lower())
+
+
+def check_output(path):
+    """verifica, antes de processar, se os resultados com vários quadros podem ser gravados"""
+    if is_sequence(path):
+        if not sequence_paths(path):
+            raise ValueError(f'No frames found for sequence {path}')
+        return
+    with Image.open(path) as img:
+        frames = getattr(img, 'n_frames', 1)
+    format = output_format(path)
+    if frames > 1 and format not in Image.SAVE_ALL:
+        raise ValueError(f'{format or Path(path).suffix} files can not be saved with multiple frames; use a numbered sequence of files instead')
+
+
+def _drain(items):
+    """itens da fila até o fim (None); a exceção de uma etapa é relançada na seguinte"""
+    while True:
+        item = items.get()
+        if item is None:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def run_stage(items, size):
+    """consome o iterável items em uma thread, guardando até size itens em uma fila à frente de
+    quem os usa, e retorna os itens da fila (a thread espera quando a fila está cheia)"""
+    results = queue.Queue(size)
+
+    def produce():
+        try:
+            for item in items:
+                results.put(item)
+            results.put(None)
+        except Exception as e:
+            results.put(e)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return _drain(results)
+
+
+class FrameWriter:
+    """grava os resultados de cada efeito à medida que os quadros ficam prontos: em uma sequência
+    numerada (um arquivo por quadro) ou, se a entrada tinha os quadros em um arquivo só, em um arquivo
+    de vários quadros no mesmo formato, codificado por uma thread de cada efeito que recebe os quadros
+    por uma fila de size quadros"""
+
+    def __init__(self, path, size=DEFAULT_QUEUE_FRAMES):
+        self.path = path
+        self.size = size
+        self.format = output_format(path)
+        # duração de cada quadro; a lista é passada ao PIL e lida por ele enquanto os quadros chegam
+        self.durations = []
+        self.options = None
+        # efeito -> (fila dos quadros, thread que grava o arquivo)
+        self.writers = {}
+        self.errors = []
+
+    def add(self, frame_path, info, results):
+        """grava (ou passa para a thread de gravação) os resultados de um quadro; retorna os arquivos gravados"""
+        if is_sequence(self.path):
+            return [pipeline.save_img(result, frame_path, effect_name) for effect_name, _, result in results]
+        if self.options is None:
+            self.options = {}
+            if info.get('duration') is not None:
+                self.options['duration'] = self.durations
+            if info.get('loop') is not None:
+                self.options['loop'] = info['loop']
+        self.durations.append(info.get('duration') or 0)
+        for effect_name, _, result in results:
+            with profiling.stage('encode', frame=len(self.durations) - 1):
+                img = Image.fromarray(result)
+                # a redução para 256 cores é a parte mais cara da gravação do GIF, e é feita aqui, quadro a quadro
+                if self.format == 'GIF':
+                    img = img.convert('P', palette=Image.Palette.ADAPTIVE)
+            if self.errors:
+                raise self.errors[0]
+            if effect_name in self.writers:
+                self.writers[effect_name][0].put(img)
+                continue
+            frames = queue.Queue(self.size)
+            thread = threading.Thread(target=self._write, args=(pipeline.result_path(self.path, effect_name), img, _drain(frames)), daemon=True)
+            thread.start()
+            self.writers[effect_name] = frames, thread
+        return []
+
+    def _write(self, new_path, first, frames):
+        """grava o arquivo de um efeito com o primeiro quadro e os seguintes, tirados da fila até o fim"""
+        try:
+            with profiling.stage('encode', file=new_path):
+                if self.format == 'TIFF':
+                    # o PIL junta todas as páginas em uma lista antes de gravar o TIFF; aqui cada página
+                    # é acrescentada ao arquivo assim que chega
+                    with TiffImagePlugin.AppendingTiffWriter(new_path, new=True) as tiff:
+                        for img in itertools.chain([first], frames):
+                            img.save(tiff, format='TIFF')
+                            tiff.newFrame()
+                elif self.format == 'GIF':
+                    first.save(new_path, save_all=True, append_images=frames, **self.options)
+                elif self.format in Image.SAVE_ALL:
+                    # os outros formatos (o PNG, por exemplo) percorrem os quadros mais de uma vez
+                    first.save(new_path, save_all=True, append_images=list(frames), **self.options)
+                else:
+                    first.save(new_path)
+        except Exception as e:
+            self.errors.append(e)
+        # esvazia a fila até o fim, para que add() não fique esperando por uma thread que parou
+        for _ in frames:
+            pass
+
+    def close(self):
+        """espera as threads terminarem de gravar os arquivos de vários quadros; retorna os arquivos gravados"""
+        saved = []
+        for effect_name, (frames, thread) in self.writers.items():
+            frames.put(None)
+            thread.join()
+            saved.append(pipeline.result_path(self.path, effect_name))
+        if self.errors:
+            raise self.errors[0]
+        return saved
+
+
+def run(args):
+    """processa todos os quadros e grava os resultados; informa a vazão em quadros por segundo"""
+    check_output(args.FILE)
+    filters = pipeline.load_filters(args)
+    result_cache = pipeline.open_cache(args)
+    # tempo em que cada etapa ficou ocupada (não conta a espera pelas filas)
+    busy = {'decode': 0.0, 'filter': 0.0, 'encode': 0.0}
+
+    def decoded():
+        frames = read_frames(args.FILE, args.grayscale, args.frame_start)
+        while True:
+            start = time.perf_counter()
+            frame = next(frames, None)
+            busy['decode'] += time.perf_counter() - start
+            if frame is None:
+                return
+            yield frame
+
+    def filtered(frames):
+        for frame_path, info, img_arr in frames:
+            start = time.perf_counter()
+            results = list(pipeline.process(img_arr, args, filters, result_cache))
+            busy['filter'] += time.perf_counter() - start
+            yield frame_path, info, results
+
+    start = time.perf_counter()
+    writer = FrameWriter(args.FILE, args.frame_queue)
+    count = 0
+    for frame_path, info, results in run_stage(filtered(run_stage(decoded(), args.frame_queue)), args.frame_queue):
+        encode_start = time.perf_counter()
+        for saved in writer.add(frame_path, info, results):
+            print(saved)
+        busy['encode'] += time.perf_counter() - encode_start
+        count += 1
+    encode_start = time.perf_counter()
+    for saved in writer.close():
+        print(saved)
+    busy['encode'] += time.perf_counter() - encode_start
+    elapsed = time.perf_counter() - start
+
+    stages = ', '.join(f'{name} {seconds:.2f}s' for name, seconds in busy.items())
+    print(f'{count} frames in {elapsed:.2f}s: {count / elapsed if elapsed else 0:.2f} frames/s (busy time: {stages})')
@@ -1,142 +1,133 @@
 #!/usr/bin/env python3
 
 import argparse
-import numpy as np
-from matplotlib import pyplot as plt
-from PIL import Image
-from pathlib import Path
-import statistics
+import sys
 
 import display
-import filter
-
-
-def save_img(img_array, original_path, effect_name):
-    """Salva a imagem com o efeito aplicado no mesmo diretório e com o mesmo nome, mas com '_<effect_name>' antes da extensão"""
-    new_img = Image.fromarray(img_array)
-    path = Path(original_path)
-    # save image on the same path and name but with '_<effect_name>' before the extension
-    new_img.save(f'{path.parent}/{path.stem}_{effect_name}{path.suffix}')
+import frames
+import pipeline
+import preview
+import profiling
+import stream
+import watch
 
 
 # TODO: short options
 parser = argparse.ArgumentParser()
 parser.add_argument('FILE', help='path to input image')
 parser.add_argument('--output', choices=['terminal', 'terminal-numbers', 'matplotlib', 'save'], default='matplotlib', help='sets image output method')
-parser.add_argument('--grayscale', action='store_true', help='convert image to grayscale')
 parser.add_argument('--no-original', action='store_true', help='do not show the original image')
-# 1
-parser.add_argument('--yiq', action='store_true', help='performs RGB-YIQ-RGB conversion')
-# 2
-parser.add_argument('--neg-rgb', action='store_true', help='performs RGB negative')
-parser.add_argument('--neg-y', action='store_true', help='performs Y negative')
-# 3 & 4
-# filtros e sequencias de filtros podem ser especificadas multiplas vezes para ver o efeito de cada um
-# os filtros especiais (como mediana) devem ser colocados entre colchetes sem espaços (ex: [mediana,3,3,1,1,true]
-# o formato desses filtros especiais é: [nome, linhas, colunas, pivô x, pivô y, extensão com zeros]
-parser.add_argument('--filter', action='append', help='apply filter to image. Can be used multiple times for multiple filters. Function filters (like median) should be put inside square brackets without spaces (e.g. [median,3,3,1,1,true]')
-parser.add_argument('--filter-sequence', nargs='+', action='append', help='apply a sequence of filters to image. Can be used multiple times for multiple filter sequences')
-parser.add_argument('--filter-sum', nargs='+', action='append', help='applies all filter t the image and sums the results')
+pipeline.add_processing_arguments(parser)
+parser.add_argument('--stream', action='store_true', help='read, process and save the image in strips of rows, without loading it whole (for images larger than memory). Results are always saved')
+parser.add_argument('--strip-rows', type=int, default=256, help='number of image rows read at a time in stream mode')
+parser.add_argument('--stream-format', choices=['ppm', 'npy'], default='ppm', help='file format of the results saved in stream mode')
+parser.add_argument('--frames', action='store_true', help='process every frame of an animated GIF, a multi-page TIFF (or another multi-frame format) or a numbered sequence of files (FILE with a printf-style number, e.g. frames/%%04d.png); frames are decoded, filtered and encoded in pipelined threads and results are always saved, as multi-frame files or as numbered sequences')
+parser.add_argument('--frame-start', type=int, metavar='N', help='first number of a frame sequence (default: 0, or 1 if there is no frame 0)')
+parser.add_argument('--frame-queue', type=int, default=frames.DEFAULT_QUEUE_FRAMES, metavar='FRAMES', help='frames waiting between the decode, filter and encode stages in --frames mode')
+parser.add_argument('--preview', nargs='?', type=int, const=512, metavar='SIDE', help='with terminal or matplotlib output, show each result computed on a reduced image (at most SIDE pixels on its longest side, default 512) while the full resolution result is computed, then replace it')
+parser.add_argument('--watch', action='store_true', help='keep running and update the results whenever the image or a json filter file changes; intermediate results of every stage are kept in memory (up to --cache-memory MB, 1024 by default) so only the stages from the first changed filter on are recomputed')
+parser.add_argument('--watch-interval', type=float, default=0.5, help='seconds between checks for changed files in --watch mode')
+parser.add_argument('--profile', nargs='?', const='profile.json', metavar='TRACE', help='print the wall time, CPU time and peak allocated memory of each stage and filter, and save them as a Chrome trace event file (default: profile.json) that can be opened in chrome://tracing or Perfetto')
+parser.add_argument('--profile-no-memory', action='store_true', help='do not trace memory allocations in --profile (faster, peak memory is reported as 0)')
 
 args = parser.parse_args()
+if args.stream and args.float_pipeline:
+    parser.error('--float-pipeline is not supported in stream mode')
+if args.preview and (args.stream or args.output == 'save'):
+    parser.error('--preview needs terminal or matplotlib output')
+if args.roi and (args.stream or args.preview):
+    parser.error('--roi is not supported with --stream or --preview')
+if args.watch and (args.stream or args.preview):
+    parser.error('--watch is not supported with --stream or --preview')
+if args.frames and (args.stream or args.preview or args.watch):
+    parser.error('--frames is not supported with --stream, --preview or --watch')
+if args.profile:
+    profiler = profiling.enable(memory=not args.profile_no_memory)
 
 IMAGE_PATH = args.FILE
+
+# Modo de fluxo: a imagem nunca é carregada inteira, e os resultados são gravados faixa a faixa
+if args.stream:
+    with profiling.stage('stream'):
+        try:
+            stream.process(IMAGE_PATH, args)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.profile:
+        profiler.summary()
+        profiler.trace(args.profile)
+    sys.exit()
+
+# Modo de quadros: cada quadro da imagem (ou da sequência de arquivos) é processado e salvo
+if args.frames:
+    with profiling.stage('frames'):
+        try:
+            frames.run(args)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.profile:
+        profiler.summary()
+        profiler.trace(args.profile)
+    sys.exit()
+
+# Modo de observação: os resultados são atualizados a cada mudança da imagem ou dos filtros
+if args.watch:
+    watch.run(args)
+    # o perfil acumula todas as atualizações e é impresso quando a observação termina (Ctrl+C)
+    if args.profile:
+        profiler.summary()
+        profiler.trace(args.profile)
+    sys.exit()
+
 display_handler = {'terminal': display.terminal,
                    'terminal-numbers': display.terminal_numbers,
                    'matplotlib': display.matplotlib_imshow,
                    'save': lambda *args: None # do nothing
                    }[args.output]
-save_handler = save_img if args.output == 'save' else lambda *args: None # do nothing
-
-with Image.open(IMAGE_PATH) as img:
-    if args.grayscale:
-        img = img.convert('L')
-    img_arr = np.asarray(img.convert('RGB'))
-    img_arr_norm = img_arr / 255
-
-
-RGB_TO_YIQ_MATRIX = np.array([
-                              [0.299, 0.587, 0.114],
-                              [0.596, -0.274, -0.322],
-                              [0.211, -0.523, 0.312]
-                            ])
-
-YIQ_TO_RGB_MATRIX = np.array([
-                                [1.000, 0.956, 0.621],
-                                [1.000, -0.272, -0.647],
-                                [1.000, -1.106, 1.703]
-                            ])
+save_handler = pipeline.save_img if args.output == 'save' else lambda *args: None # do nothing
+
+# carrega os filtros uma única vez, mesmo que apareçam em mais de uma opção
+with profiling.stage('load filters'):
+    filters = pipeline.load_filters(args)
+result_cache = pipeline.open_cache(args)
+# com --roi, só a parte da imagem de que a região dos resultados depende é lida (ver pipeline.roi_input_region)
+origin, shape = (0, 0), None
+if args.roi:
+    shape = stream.image_size(IMAGE_PATH)
+    try:
+        rows, columns = pipeline.roi_input_region(args, filters, shape)
+    except ValueError as e:
+        parser.error(str(e))
+    origin = (rows[0], columns[0])
+    with profiling.stage('read region'):
+        img_arr = stream.read_region(IMAGE_PATH, rows, columns, args.grayscale)
+else:
+    img_arr = pipeline.open_image(IMAGE_PATH, args.grayscale)
 
 if not args.no_original:
-    display_handler(img_arr, 'Original Image')
-
-# Realiza uma operação de conversão de espaço de cores da imagem de RGB para YIQ e novamente de volta para RGB
-if args.yiq:
-    #? TODO: podemos normalizar os valores?
-    img_arr_norm_yiq = np.dot(img_arr_norm.copy(), RGB_TO_YIQ_MATRIX.T) # Cria uma cópia do array de imagem normalizado e multiplica o array de imagem  matriz de conversão de RGB para YIQ
-    img_arr_norm_rgb = np.dot(img_arr_norm_yiq, YIQ_TO_RGB_MATRIX.T) # Retorna para RGB
-    img_arr_neg_rgb = np.clip(img_arr_norm_rgb * 255, 0, 255).round().astype(np.uint8) # Multiplica o array por 255 e limita seus valores entre 0 e 255 usando a função np.clip()
-    display_handler(img_arr_neg_rgb, 'RGB-YIQ-RGB Image') # exibir
-    save_handler(img_arr_neg_rgb, IMAGE_PATH, 'yiq')
-
-# Negativo em RGB
-if args.neg_rgb:
-    img_arr_neg_rgb = (255 - img_arr).astype(np.uint8) 
-    display_handler(img_arr_neg_rgb, 'RGB Negative Image')
-    save_handler(img_arr_neg_rgb, IMAGE_PATH, 'neg_rgb')
-
-# Negativo em Y
-if args.neg_y:
-    img_arr_norm_yiq = np.dot(img_arr_norm.copy(), RGB_TO_YIQ_MATRIX.T)
-    img_arr_norm_yiq[:, :, 0] = 1 - img_arr_norm_yiq[:, :, 0] # Inverte Y
-    img_arr_norm_rgb = np.dot(img_arr_norm_yiq, YIQ_TO_RGB_MATRIX.T)
-    img_arr_rgb_neg_y = np.clip(img_arr_norm_rgb * 255, 0, 255).round().astype(np.uint8)
-    display_handler(img_arr_rgb_neg_y, 'Y Negative Image')
-    save_handler(img_arr_rgb_neg_y, IMAGE_PATH, 'neg_y')
-
-# Verifica se a opção filter foi passada como argumento
-if args.filter:
-    # Itera sobre cada filtro passado como argumento
-    for f in args.filter:
-        if f[0] == '[' and f[-1] == ']': # Se o elemento for uma string delimitada por colchetes [ e ], ele é tratado como uma função definida pelo usuário
-            new_filter = filter.get_function_filter(f)
-        else: # Caso contrário, considera que é um filtro em formato JSON e utiliza o método from_json do módulo filter para obter a instância do filtro
-            new_filter = filter.DataFilter.from_json(f)
-        # Aplica o filtro na imagem, criando uma cópia da matriz de pixels
-        img_arr_filtered = new_filter.apply(img_arr.copy())
-        display_handler(img_arr_filtered, f'Filtered Image with {new_filter.name}')
-        save_handler(img_arr_filtered, IMAGE_PATH, f'filter-{new_filter.name}')
-
-# Verifica se há uma sequência de filtros especificada nos argumentos
-if args.filter_sequence:
-    # Itera sobre a lista de sequências de filtros especificada nos argumentos
-    for fs in args.filter_sequence:
-        # Faz uma cópia da imagem original para ser filtrada
-        img_arr_filtered = img_arr.copy()
-        for f in fs:
-            if f[0] == '[' and f[-1] == ']': # Se o elemento for uma string delimitada por colchetes [ e ], ele é tratado como uma função definida pelo usuário
-                new_filter = filter.get_function_filter(f)
-            else: # Caso contrário, considera que é um filtro em formato JSON e utiliza o método from_json do módulo filter para obter a instância do filtro
-                new_filter = filter.DataFilter.from_json(f)
-            img_arr_filtered = new_filter.apply(img_arr_filtered)
-        display_handler(img_arr_filtered, f'Filtered Image with {fs}')
-        save_handler(img_arr_filtered, IMAGE_PATH, f'filter sequence-{[Path(f).stem for f in fs]}')
-
-# Verifica se há uma sequência de filtros a serem adicionados
-if args.filter_sum:
-    # Itera sobre a lista de sequências de filtros especificada nos argumentos
-    for fs in args.filter_sum:
-        # Faz uma cópia da imagem original para ser filtrada
-        img_arr_filtered = img_arr.copy()
-        filtered_imgs = []
-        for f in fs:
-            if f[0] == '[' and f[-1] == ']': # Se o elemento for uma string delimitada por colchetes [ e ], ele é tratado como uma função definida pelo usuário
-                new_filter = filter.get_function_filter(f)
-            else: # Caso contrário, considera que é um filtro em formato JSON e utiliza o método from_json do módulo filter para obter a instância do filtro
-                new_filter = filter.DataFilter.from_json(f)
-            filtered_imgs.append(new_filter.apply(img_arr.copy()))
-
-        final_img = filter.histogram_expansion(sum(filtered_imgs))
-        display_handler(final_img, f'Sum Filtered Image with {fs}')
-        save_handler(final_img, IMAGE_PATH, f'filter sum-{[Path(f).stem for f in fs]}')
-
+    original = img_arr if args.roi is None else pipeline.crop(img_arr, args.roi, origin)
+    with profiling.stage(args.output, 'display', title='Original Image'):
+        display_handler(original, 'Original Image')
+
+if args.preview:
+    wait = display.matplotlib_wait if args.output == 'matplotlib' else None
+    results = preview.process(img_arr, args, filters, result_cache, args.preview, wait)
+else:
+    results = (result + (False,) for result in pipeline.process(img_arr, args, filters, result_cache, origin, shape))
+
+# exibe e salva cada resultado assim que ele fica pronto; as prévias são substituídas pelo resultado final
+erase_preview = None
+for effect_name, title, result, is_preview in results:
+    with profiling.stage(args.output, 'display', title=title):
+        if erase_preview is not None:
+            erase_preview()
+            erase_preview = None
+        if is_preview:
+            erase_preview = display.preview(args.output, result, title)
+            continue
+        display_handler(result, title)
+    save_handler(result, IMAGE_PATH, effect_name)
+
+if args.profile:
+    profiler.summary()
+    profiler.trace(args.profile)
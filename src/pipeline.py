@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from PIL import Image
+from pathlib import Path
+import os
+
+import cache
+import color
+import filter
+import profiling
+
+
+def workers_count(value):
+    """converte a opção --workers: 0 usa todas as CPUs"""
+    workers = int(value)
+    return os.cpu_count() if workers == 0 else workers
+
+
+def region(value):
+    """converte a opção --roi (x,y,largura,altura)"""
+    values = tuple(int(v) for v in value.split(','))
+    if len(values) != 4:
+        raise ValueError(f'Invalid region {value}. Region must be x,y,width,height')
+    return values
+
+
+def add_processing_arguments(parser):
+    """adiciona ao parser as opções de processamento, compartilhadas pelos modos da linha de comando"""
+    parser.add_argument('--grayscale', action='store_true', help='convert image to grayscale')
+    # 1
+    parser.add_argument('--yiq', action='store_true', help='performs RGB-YIQ-RGB conversion')
+    # 2
+    parser.add_argument('--neg-rgb', action='store_true', help='performs RGB negative')
+    parser.add_argument('--neg-y', action='store_true', help='performs Y negative')
+    # 3 & 4
+    # filtros e sequencias de filtros podem ser especificadas multiplas vezes para ver o efeito de cada um
+    # os filtros especiais (como mediana) devem ser colocados entre colchetes sem espaços (ex: [mediana,3,3,1,1,true]
+    # o formato desses filtros especiais é: [nome, linhas, colunas, pivô x, pivô y, extensão com zeros]
+    parser.add_argument('--filter', action='append', help='apply filter to image. Can be used multiple times for multiple filters. Function filters (like median) should be put inside square brackets without spaces (e.g. [median,3,3,1,1,true]')
+    parser.add_argument('--filter-sequence', nargs='+', action='append', help='apply a sequence of filters to image. Can be used multiple times for multiple filter sequences')
+    parser.add_argument('--float-pipeline', action='store_true', help='keep intermediate results of --filter-sequence and --filter-sum in floating point; json filters without offset, limit or histogram expansion of their own are merged into a single kernel')
+    parser.add_argument('--filter-sum', nargs='+', action='append', help='applies all filter t the image and sums the results')
+    parser.add_argument('--engine', choices=filter.ENGINES, default='auto', help='correlation engine for json filters. auto picks the cheapest one for each filter and image size')
+    parser.add_argument('--workers', type=workers_count, default=1, help='number of threads used to apply each filter (0 uses all CPUs)')
+    parser.add_argument('--tile-rows', type=int, help='number of image rows processed by each thread at a time')
+    parser.add_argument('--roi', type=region, metavar='X,Y,W,H', help='only compute this region of each result (in pixels of the result); filters read just the part of the image that the region depends on, and the output is the same as cropping the whole result')
+    parser.add_argument('--cache', action='store_true', help='cache filter results on disk (in --cache-dir), keyed by the image and filter contents, and reuse them')
+    parser.add_argument('--cache-dir', default=cache.DEFAULT_DIRECTORY, help='directory where filter results are cached with --cache')
+    parser.add_argument('--cache-size', type=float, default=1024, help='maximum size of the cache directory in MB (least recently used results are removed first)')
+    parser.add_argument('--cache-memory', type=float, default=0, help='keep up to this many MB of results in memory (also without --cache)')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or write cached results, even with --cache or --cache-memory')
+
+
+def open_image(path, grayscale=False):
+    """abre a imagem como um array RGB de 8 bits"""
+    with Image.open(path) as img:
+        return decode(img, grayscale)
+
+
+def decode(img, grayscale=False, **args):
+    """converte a imagem do PIL (ou o quadro em que ela está) em um array RGB de 8 bits
+    args são gravados no perfil de execução"""
+    # o PIL só decodifica a imagem quando os pixels são usados
+    with profiling.stage('decode', format=img.format, **args):
+        img.load()
+        if grayscale:
+            img = img.convert('L')
+        # a conversão sempre cria outra imagem, então o array não muda se img passar para outro quadro
+        img = img.convert('RGB')
+    with profiling.stage('asarray'):
+        return np.asarray(img)
+
+
+def result_path(original_path, effect_name, output_dir=None):
+    """caminho do resultado: no mesmo diretório (ou em output_dir) e com o mesmo nome, mas com '_<effect_name>' antes da extensão"""
+    path = Path(original_path)
+    directory = path.parent if output_dir is None else Path(output_dir)
+    return f'{directory}/{path.stem}_{effect_name}{path.suffix}'
+
+
+def save_img(img_array, original_path, effect_name, output_dir=None):
+    """Salva a imagem com o efeito aplicado no mesmo diretório (ou em output_dir) e com o mesmo nome, mas com '_<effect_name>' antes da extensão"""
+    new_img = Image.fromarray(img_array)
+    # save image on the same path and name but with '_<effect_name>' before the extension
+    new_path = result_path(original_path, effect_name, output_dir)
+    with profiling.stage('encode', file=new_path):
+        new_img.save(new_path)
+    return new_path
+
+
+def roi_input_region(args, filters, shape):
+    """região da imagem de entrada (linhas e colunas, como intervalos [início, fim)) de que dependem
+    as regiões --roi de todos os resultados pedidos (ver filter.sequence_region); a soma de filtros
+    expande o histograma da soma inteira, então precisa da imagem inteira"""
+    # a própria região, usada pelas operações de cor e para exibir a imagem original
+    regions = [filter.sequence_region([], shape, args.roi)]
+    for fs in [[f] for f in args.filter or []] + (args.filter_sequence or []):
+        regions.append(filter.sequence_region([filters[f] for f in fs], shape, args.roi))
+    if args.filter_sum:
+        regions.append(((0, shape[0]), (0, shape[1])))
+    return tuple((min(r[axis][0] for r in regions), max(r[axis][1] for r in regions)) for axis in range(2))
+
+
+def crop(img_arr, roi, origin=(0, 0)):
+    """região roi = (x, y, largura, altura) da imagem, da qual img_arr é a parte que começa em origin"""
+    x, y, width, height = roi
+    return img_arr[y - origin[0]:y - origin[0] + height, x - origin[1]:x - origin[1] + width]
+
+
+def filter_specs(args):
+    """textos da linha de comando de todos os filtros citados nas opções, sem repetições"""
+    specs = list(args.filter or [])
+    for fs in (args.filter_sequence or []) + (args.filter_sum or []):
+        specs.extend(fs)
+    return list(dict.fromkeys(specs))
+
+
+def load_filters(args):
+    """carrega uma única vez cada filtro citado nas opções
+    retorna um dicionário que associa o texto da linha de comando ao filtro"""
+    return {f: filter.load_filter(f, args.engine) for f in filter_specs(args)}
+
+
+def open_cache(args):
+    """abre o cache de resultados das opções, ou retorna None se ele estiver desligado
+    sem --cache, só os resultados em memória (--cache-memory) são guardados"""
+    if args.no_cache or not (args.cache or args.cache_memory):
+        return None
+    return cache.ResultCache(args.cache_dir if args.cache else None, int(args.cache_size * 2**20), int(args.cache_memory * 2**20))
+
+
+def cached(result_cache, image_key, operation, compute):
+    """retorna compute(), guardado no cache com a chave da imagem e de operation() (se houver cache)"""
+    if result_cache is None:
+        return compute()
+    return result_cache.cached(cache.operation_key(image_key, operation()), compute)
+
+
+def apply_sequence(img_arr, args, filters, fs, result_cache=None, image_key=None, origin=(0, 0), shape=None):
+    """aplica a sequência de filtros fs; com cache, o resultado de cada prefixo da sequência é
+    guardado, e a aplicação recomeça do maior prefixo já calculado
+    com --roi, img_arr pode ser só a parte da imagem (de dimensões shape) que começa em origin"""
+    sequence = [filters[f] for f in fs]
+    if args.roi is not None:
+        shape = tuple(shape or img_arr.shape[:2])
+        return cached(result_cache, image_key, lambda: ['region', [f.spec() for f in sequence], args.float_pipeline, list(args.roi), list(origin), list(shape)],
+                      lambda: filter.apply_region(sequence, img_arr, args.roi, args.workers, args.tile_rows, args.float_pipeline, origin, shape))
+    if result_cache is None:
+        return filter.apply_sequence(sequence, img_arr, args.workers, args.tile_rows, args.float_pipeline)
+    specs = [f.spec() for f in sequence]
+    # em ponto flutuante os resultados intermediários não são imagens: só o final é guardado
+    if args.float_pipeline:
+        return cached(result_cache, image_key, lambda: ['float sequence', specs],
+                      lambda: filter.apply_sequence(sequence, img_arr, args.workers, args.tile_rows, True))
+    keys = [cache.operation_key(image_key, ['sequence', specs[:n + 1]]) for n in range(len(specs))]
+    start, result = 0, img_arr
+    for n in range(len(keys), 0, -1):
+        stored = result_cache.get(keys[n - 1])
+        if stored is not None:
+            start, result = n, stored
+            break
+    for n in range(start, len(sequence)):
+        result = sequence[n].apply(result, args.workers, args.tile_rows)
+        result_cache.put(keys[n], result)
+    return result
+
+
+def sum_sequences(img_arr, args, filters, fs, result_cache, image_key):
+    """soma de filtros em que o resultado de cada filtro é guardado no cache como o de um --filter;
+    igual ao de filter.apply_sum (a soma dos resultados em inteiros, com o histograma expandido)"""
+    results = [apply_sequence(img_arr, args, filters, [f], result_cache, image_key) for f in fs]
+    if len({result.shape for result in results}) > 1:
+        raise ValueError(f'Filters in filter sum {[filters[f].name for f in fs]} produce images of different sizes')
+    accumulator = np.zeros(results[0].shape, dtype=np.int32)
+    for result in results:
+        accumulator += result
+    return filter.epilogue(accumulator, limit=None, expansion=True).astype(np.uint8)
+
+
+def process(img_arr, args, filters, result_cache=None, origin=(0, 0), shape=None, incremental=False):
+    """aplica à imagem as operações pedidas nas opções, na ordem da linha de comando
+    gera (nome do efeito, título, imagem resultante) para cada resultado
+    result_cache: cache de resultados dos filtros (ver open_cache), ou None
+    com --roi, img_arr pode ser só a parte (ver roi_input_region) que começa em origin de uma imagem
+    de dimensões shape; os resultados são só a região --roi, com '-roi' no nome do efeito
+    incremental: o resultado de cada filtro de uma --filter-sum também é guardado no cache, para
+    que só os filtros alterados sejam reaplicados (modo --watch)"""
+    image_key = None if result_cache is None else cache.image_key(img_arr)
+    for name, title, result in _process(img_arr, args, filters, result_cache, image_key, origin, shape, incremental):
+        if args.roi is not None:
+            name = f'{name}-roi{"_".join(map(str, args.roi))}'
+        yield name, title, result
+
+
+def _process(img_arr, args, filters, result_cache, image_key, origin, shape, incremental):
+    # as operações de cor são pixel a pixel: basta recortar a região
+    source = img_arr
+    if args.roi is not None:
+        filter.sequence_region([], shape or img_arr.shape[:2], args.roi)
+        source = crop(img_arr, args.roi, origin)
+
+    # Realiza uma operação de conversão de espaço de cores da imagem de RGB para YIQ e novamente de volta para RGB
+    if args.yiq:
+        with profiling.stage('yiq', 'color'):
+            result = color.rgb_yiq_rgb(source)
+        yield 'yiq', 'RGB-YIQ-RGB Image', result
+
+    # Negativo em RGB
+    if args.neg_rgb:
+        with profiling.stage('neg_rgb', 'color'):
+            result = color.negative_rgb(source)
+        yield 'neg_rgb', 'RGB Negative Image', result
+
+    # Negativo em Y
+    if args.neg_y:
+        with profiling.stage('neg_y', 'color'):
+            result = color.negative_y(source)
+        yield 'neg_y', 'Y Negative Image', result
+
+    # Verifica se a opção filter foi passada como argumento
+    if args.filter:
+        # Itera sobre cada filtro passado como argumento
+        for f in args.filter:
+            new_filter = filters[f]
+            # Aplica o filtro na imagem (um filtro sozinho é uma sequência de um filtro, e compartilha o cache)
+            img_arr_filtered = apply_sequence(img_arr, args, filters, [f], result_cache, image_key, origin, shape)
+            yield f'filter-{new_filter.name}', f'Filtered Image with {new_filter.name}', img_arr_filtered
+
+    # Verifica se há uma sequência de filtros especificada nos argumentos
+    if args.filter_sequence:
+        # Itera sobre a lista de sequências de filtros especificada nos argumentos
+        for fs in args.filter_sequence:
+            img_arr_filtered = apply_sequence(img_arr, args, filters, fs, result_cache, image_key, origin, shape)
+            yield f'filter sequence-{[Path(f).stem for f in fs]}', f'Filtered Image with {fs}', img_arr_filtered
+
+    # Verifica se há uma sequência de filtros a serem adicionados
+    if args.filter_sum:
+        # Itera sobre a lista de sequências de filtros especificada nos argumentos
+        for fs in args.filter_sum:
+            summed = [filters[f] for f in fs]
+            if incremental and result_cache is not None and not args.float_pipeline and args.roi is None:
+                final_img = cached(result_cache, image_key, lambda: ['sum', [f.spec() for f in summed], False],
+                                   lambda: sum_sequences(img_arr, args, filters, fs, result_cache, image_key))
+            else:
+                final_img = cached(result_cache, image_key, lambda: ['sum', [f.spec() for f in summed], args.float_pipeline],
+                                   lambda: filter.apply_sum(summed, img_arr, args.workers, args.tile_rows, args.float_pipeline))
+            # a expansão de histograma da soma depende da imagem inteira: a região é recortada do resultado
+            if args.roi is not None:
+                final_img = crop(final_img, args.roi)
+            yield f'filter sum-{[Path(f).stem for f in fs]}', f'Sum Filtered Image with {fs}', final_img
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import queue
+import threading
+import numpy as np
+
+import filter
+import pipeline
+
+# Pré-visualização progressiva (opção --preview do src/main.py): enquanto os resultados em resolução
+# total são calculados em uma thread, as mesmas operações são aplicadas a uma versão reduzida da
+# imagem (um nível de uma pirâmide de fatores 2), com os kernels e as janelas reduzidos na mesma
+# proporção, e cada prévia é mostrada e depois substituída pelo resultado final.
+
+
+def pyramid_factor(shape, side):
+    """menor fator de redução (potência de 2) para o maior lado da imagem caber em side pixels"""
+    factor = 1
+    while max(shape[:2]) / factor > side and min(shape[:2]) // (2 * factor) >= 1:
+        factor *= 2
+    return factor
+
+
+def downscale(img_arr, factor):
+    """reduz a imagem pela média de blocos factor x factor (as linhas e colunas que sobram são descartadas)"""
+    rows, columns = img_arr.shape[0] // factor, img_arr.shape[1] // factor
+    blocks = img_arr[:rows * factor, :columns * factor].reshape(rows, factor, columns, factor, -1)
+    return blocks.mean(axis=(1, 3)).round().astype(np.uint8)
+
+
+def scaled_size(size, factor):
+    """tamanho de uma janela na imagem reduzida: kernels de até 3 taps (derivadas, emboss) ficam
+    como estão, porque não teriam mais o mesmo efeito com menos taps; os maiores diminuem até 3"""
+    return size if size <= 3 else max(3, round(size / factor))
+
+
+def _scaled_pivot(pivot, size, new_size):
+    return min(new_size - 1, int((pivot + 0.5) * new_size / size))
+
+
+def _resampling(size, new_size):
+    """matriz new_size x size que redistribui um kernel de size taps em new_size taps, integrando
+    os pesos (cada tap é constante no seu intervalo), então a soma dos pesos é mantida"""
+    edges = np.linspace(0, size, new_size + 1)
+    taps = np.arange(size)
+    return np.clip(np.minimum(edges[1:, np.newaxis], taps + 1) - np.maximum(edges[:-1, np.newaxis], taps), 0, None)
+
+
+def scale_filter(f, factor):
+    """versão do filtro para a imagem reduzida pelo fator"""
+    rows, columns = f.kernel.shape[:2]
+    new_rows, new_columns = scaled_size(rows, factor), scaled_size(columns, factor)
+    if (new_rows, new_columns) == (rows, columns):
+        return f
+    pivot = (_scaled_pivot(f.pivot[0], rows, new_rows), _scaled_pivot(f.pivot[1], columns, new_columns))
+    if isinstance(f, filter.FunctionFilter):
+        return filter.FunctionFilter(f.name, new_rows, new_columns, pivot, f.zero_extension, f.func, f.image_func)
+    kernel = np.einsum('ij,jkc,lk->ilc', _resampling(rows, new_rows), f.kernel, _resampling(columns, new_columns))
+    return filter.DataFilter(f.name, kernel, pivot, f.zero_extension, f.limit_function, f.offset, f.histogram_expansion, f.engine)
+
+
+def process(img_arr, args, filters, result_cache=None, side=512, wait=None):
+    """como pipeline.process, mas gera (nome do efeito, título, imagem, prévia): antes de cada
+    resultado final que ainda não ficou pronto vem uma prévia (prévia True) calculada na imagem reduzida
+    wait: função chamada repetidamente enquanto um resultado final não fica pronto (ex: para a
+    janela do matplotlib continuar respondendo); sem ela, a espera bloqueia"""
+    factor = pyramid_factor(img_arr.shape, side)
+    if factor == 1:
+        for result in pipeline.process(img_arr, args, filters, result_cache):
+            yield result + (False,)
+        return
+
+    # resultados finais, na ordem, calculados em outra thread; None marca o fim
+    finished = queue.Queue()
+
+    def compute():
+        try:
+            for result in pipeline.process(img_arr, args, filters, result_cache):
+                finished.put(result)
+            finished.put(None)
+        except Exception as e:
+            finished.put(e)
+
+    threading.Thread(target=compute, daemon=True).start()
+
+    small = downscale(img_arr, factor)
+    scaled = {spec: scale_filter(f, factor) for spec, f in filters.items()}
+    previews = pipeline.process(small, args, scaled)
+    while True:
+        if finished.empty():
+            preview = next(previews, None)
+            if preview is not None:
+                effect_name, title, result = preview
+                yield effect_name, f'{title} (preview 1:{factor})', result, True
+            if wait is not None:
+                while finished.empty():
+                    wait()
+        else:
+            # o resultado final já está pronto: a prévia dele não é mostrada
+            next(previews, None)
+        result = finished.get()
+        if result is None:
+            return
+        if isinstance(result, Exception):
+            raise result
+        yield result + (False,)
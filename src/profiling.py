@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Perfil de execução por etapa (ver a opção --profile do src/main.py): os trechos do programa
+# marcados com stage(...) registram o tempo de relógio, o tempo de CPU do processo (que inclui
+# as threads dos filtros) e o pico de memória alocada durante a etapa. Sem um perfil ativo,
+# stage() não faz nada.
+
+_profiler = None
+
+
+class Profiler:
+    """registra as etapas executadas, aninhadas umas nas outras, em uma ou mais threads
+    memory: mede o pico de memória alocada com o tracemalloc (deixa o programa um pouco mais lento);
+    o pico é o do processo, então inclui o que as outras threads alocaram durante a etapa"""
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.events = []
+        self.origin = time.perf_counter()
+        # etapas abertas (de todas as threads): [memória alocada na entrada, maior pico visto] de cada uma
+        self.open = []
+        self.lock = threading.Lock()
+        if memory:
+            tracemalloc.start()
+
+    def _peak(self):
+        """pico de memória desde a última chamada, somado às etapas abertas"""
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        for frame in self.open:
+            frame[1] = max(frame[1], peak)
+
+    @contextmanager
+    def stage(self, name, category='stage', **args):
+        if self.memory:
+            with self.lock:
+                self._peak()
+                current, _ = tracemalloc.get_traced_memory()
+                frame = [current, current]
+                self.open.append(frame)
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - start, time.process_time() - cpu
+            peak = 0
+            if self.memory:
+                with self.lock:
+                    self._peak()
+                    del self.open[next(index for index, open_frame in enumerate(self.open) if open_frame is frame)]
+                peak = frame[1] - frame[0]
+            self.events.append({'name': name, 'category': category, 'start': start - self.origin,
+                                'wall': wall, 'cpu': cpu, 'peak': peak, 'thread': threading.get_ident(), 'args': args})
+
+    def stop(self):
+        if self.memory:
+            tracemalloc.stop()
+
+    def summary(self, file=sys.stderr):
+        """imprime uma tabela com o total de cada etapa e de cada filtro"""
+        totals = {}
+        for event in self.events:
+            total = totals.setdefault((event['category'], event['name']), {'count': 0, 'wall': 0, 'cpu': 0, 'peak': 0})
+            total['count'] += 1
+            total['wall'] += event['wall']
+            total['cpu'] += event['cpu']
+            total['peak'] = max(total['peak'], event['peak'])
+        print(f'{"category":10} {"name":32} {"calls":>5} {"wall ms":>10} {"cpu ms":>10} {"peak MB":>9}', file=file)
+        for (category, name), total in sorted(totals.items(), key=lambda item: -item[1]['wall']):
+            print(f'{category:10} {name[:32]:32} {total["count"]:5} {total["wall"] * 1e3:10.2f} {total["cpu"] * 1e3:10.2f} {total["peak"] / 2**20:9.1f}', file=file)
+
+    def trace(self, path):
+        """grava as etapas no formato de eventos de trace do Chrome (chrome://tracing, Perfetto)"""
+        pid = os.getpid()
+        events = [{'name': event['name'], 'cat': event['category'], 'ph': 'X',
+                   'ts': event['start'] * 1e6, 'dur': event['wall'] * 1e6, 'pid': pid, 'tid': event['thread'],
+                   'args': dict(event['args'], cpu_ms=event['cpu'] * 1e3, peak_bytes=event['peak'])}
+                  for event in self.events]
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+def enable(memory=True):
+    """ativa o perfil global, usado por stage()"""
+    global _profiler
+    _profiler = Profiler(memory)
+    return _profiler
+
+
+def disable():
+    global _profiler
+    if _profiler is not None:
+        _profiler.stop()
+    _profiler = None
+
+
+def stage(name, category='stage', **args):
+    """marca uma etapa (use com with); args são gravados no trace"""
+    if _profiler is None:
+        return nullcontext()
+    return _profiler.stage(name, category, **args)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse
+import hmac
+import json
+import os
+import secrets
+import socket
+import socketserver
+import threading
+
+import batch
+import cache
+import filter
+import pipeline
+
+# Modo servidor: um processo de longa duração recebe trabalhos pela rede local (socket Unix ou
+# TCP em localhost), sem pagar a cada imagem a inicialização do Python, as importações e a leitura
+# dos filtros. Os filtros carregados (com a decomposição separável e demais planos calculados na
+# criação) e os caches de resultados ficam em memória e são compartilhados pelos trabalhos, que
+# rodam em paralelo, uma thread por conexão.
+#
+# Protocolo: o cliente envia uma linha JSON {"argv": [...], "cwd": "...", "raw": false, "token": "..."},
+# em que argv tem a forma dos argumentos do src/batch.py (imagens e opções de processamento). O
+# servidor responde com uma linha JSON {"results": [...]} ou {"error": "..."}; com "raw", os pixels de
+# cada resultado (uint8, linhas x colunas x 3) seguem a linha, na ordem dos resultados. Ver client.py.
+#
+# Segurança: por padrão o servidor escuta em um socket Unix que só o usuário pode abrir (0600). Em
+# TCP (--port, ou onde não há sockets Unix), qualquer processo local pode conectar, então cada
+# trabalho tem de trazer o token gravado pelo servidor em DEFAULT_TOKEN_FILE, também legível só pelo
+# usuário. Os resultados e o cache só são gravados dentro dos diretórios --root do servidor.
+
+DEFAULT_PORT = 8765
+DEFAULT_SOCKET = cache.DEFAULT_DIRECTORY / 'server.sock'
+DEFAULT_TOKEN_FILE = cache.DEFAULT_DIRECTORY / 'server.token'
+
+
+class JobArgumentParser(argparse.ArgumentParser):
+    """parser dos trabalhos: os erros voltam para o cliente em vez de encerrar o servidor"""
+
+    def error(self, message):
+        raise ValueError(message)
+
+
+job_parser = JobArgumentParser(prog='job', add_help=False)
+job_parser.add_argument('INPUT', nargs='+', help='images, directories or glob patterns to process')
+job_parser.add_argument('--output-dir', help='directory where results are saved (default: next to each image)')
+pipeline.add_processing_arguments(job_parser)
+
+
+def resolve_paths(args, cwd):
+    """torna os caminhos do trabalho relativos ao diretório do cliente, e não ao do servidor"""
+    def resolve(path):
+        return path if path.startswith('[') else os.path.join(cwd, path)
+
+    args.INPUT = [resolve(path) for path in args.INPUT]
+    args.filter = args.filter and [resolve(f) for f in args.filter]
+    args.filter_sequence = args.filter_sequence and [[resolve(f) for f in fs] for fs in args.filter_sequence]
+    args.filter_sum = args.filter_sum and [[resolve(f) for f in fs] for fs in args.filter_sum]
+    args.output_dir = args.output_dir and resolve(args.output_dir)
+    args.cache_dir = resolve(str(args.cache_dir))
+
+
+def check_path(path, roots):
+    """recusa um caminho de gravação fora dos diretórios roots (já com os links resolvidos)"""
+    real_path = os.path.realpath(path)
+    if not any(os.path.commonpath([real_path, root]) == root for root in roots):
+        raise ValueError(f'{path} is outside the directories the server may write to (--root)')
+
+
+def write_token(path):
+    """gera o token dos trabalhos em TCP e o grava em path, legível só pelo usuário"""
+    token = secrets.token_urlsafe(32)
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'w') as token_file:
+        os.chmod(path, 0o600)
+        token_file.write(token)
+    return token
+
+
+class Warm:
+    """filtros e caches de resultados mantidos entre os trabalhos"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (filtro, motor) -> (data de modificação do json, filtro carregado)
+        self.filters = {}
+        self.caches = {}
+
+    def load_filters(self, args):
+        """como pipeline.load_filters, mas reaproveita os filtros já carregados; um arquivo
+        json modificado desde a última leitura é carregado de novo e substitui o anterior"""
+        filters = {}
+        for spec in pipeline.filter_specs(args):
+            key = (spec, args.engine)
+            mtime = None if spec.startswith('[') else os.path.getmtime(spec)
+            with self.lock:
+                loaded_mtime, loaded = self.filters.get(key, (None, None))
+            if loaded is None or loaded_mtime != mtime:
+                loaded = filter.load_filter(spec, args.engine)
+                with self.lock:
+                    self.filters[key] = (mtime, loaded)
+            filters[spec] = loaded
+        return filters
+
+    def open_cache(self, args):
+        """como pipeline.open_cache, mas mantém o cache (e o cache em memória) entre os trabalhos"""
+        if args.no_cache or not (args.cache or args.cache_memory):
+            return None
+        key = (args.cache, args.cache_dir, args.cache_size, args.cache_memory)
+        with self.lock:
+            if key not in self.caches:
+                self.caches[key] = pipeline.open_cache(args)
+            return self.caches[key]
+
+
+warm = Warm()
+
+
+def run_job(argv, cwd, raw=False, roots=None):
+    """processa um trabalho; retorna a descrição dos resultados e, com raw, os pixels de cada um
+    roots: diretórios (com os links resolvidos) em que o trabalho pode gravar; None não restringe"""
+    args = job_parser.parse_args(argv)
+    resolve_paths(args, cwd)
+    if roots is not None and args.cache and not args.no_cache:
+        check_path(args.cache_dir, roots + [os.path.realpath(cache.DEFAULT_DIRECTORY)])
+    if roots is not None and args.output_dir is not None and not raw:
+        check_path(args.output_dir, roots)
+    filters = warm.load_filters(args)
+    result_cache = warm.open_cache(args)
+    if args.output_dir is not None and not raw:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    results, buffers = [], []
+    for path in batch.find_images(args.INPUT):
+        try:
+            img_arr = pipeline.open_image(path, args.grayscale)
+            for effect_name, _, result in pipeline.process(img_arr, args, filters, result_cache):
+                if raw:
+                    results.append({'image': path, 'effect': effect_name, 'shape': list(result.shape)})
+                    buffers.append(result.tobytes())
+                else:
+                    if roots is not None:
+                        check_path(pipeline.result_path(path, effect_name, args.output_dir), roots)
+                    results.append({'image': path, 'effect': effect_name,
+                                    'file': pipeline.save_img(result, path, effect_name, args.output_dir)})
+        except Exception as e:
+            results.append({'image': path, 'error': str(e)})
+    return results, buffers
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """atende uma conexão: lê um trabalho e responde com os resultados"""
+
+    def handle(self):
+        buffers = []
+        try:
+            request = json.loads(self.rfile.readline())
+            if self.server.token is not None and not hmac.compare_digest(str(request.get('token')), self.server.token):
+                raise PermissionError('invalid or missing token')
+            results, buffers = run_job(request['argv'], request.get('cwd', os.getcwd()), request.get('raw', False), self.server.roots)
+            response = {'results': results}
+        except Exception as e:
+            response = {'error': str(e)}
+        self.wfile.write(json.dumps(response).encode() + b'\n')
+        for buffer in buffers:
+            self.wfile.write(buffer)
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socket, 'AF_UNIX'):
+    class ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def server_bind(self):
+            # o socket já nasce com a permissão 0600, antes de aceitar conexões
+            os.makedirs(os.path.dirname(self.server_address), mode=0o700, exist_ok=True)
+            umask = os.umask(0o177)
+            try:
+                super().server_bind()
+            finally:
+                os.umask(umask)
+            os.chmod(self.server_address, 0o600)
+
+
+parser = argparse.ArgumentParser(description='serve image processing jobs, keeping filters and caches in memory')
+parser.add_argument('--socket', default=str(DEFAULT_SOCKET), help='Unix socket to listen on, readable only by the user (default: %(default)s)')
+parser.add_argument('--port', type=int, help=f'listen on this localhost TCP port instead (e.g. {DEFAULT_PORT}); jobs must then carry the token written to --token-file')
+parser.add_argument('--token-file', default=str(DEFAULT_TOKEN_FILE), help='file where the token required from TCP clients is written (default: %(default)s)')
+parser.add_argument('--root', action='append', metavar='DIR', help='directory where jobs may save results and caches (repeatable; default: the current directory); the default cache directory is always allowed for caches')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.port is None and hasattr(socket, 'AF_UNIX'):
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = ThreadingUnixServer(args.socket, JobHandler)
+        server.token = None
+        print(f'listening on {args.socket}')
+    else:
+        port = DEFAULT_PORT if args.port is None else args.port
+        server = ThreadingTCPServer(('127.0.0.1', port), JobHandler)
+        server.token = write_token(args.token_file)
+        print(f'listening on 127.0.0.1:{port} (token in {args.token_file})')
+    server.roots = [os.path.realpath(root) for root in args.root or [os.getcwd()]]
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+import io
+import itertools
+import queue
+import struct
+import threading
+import numpy as np
+from PIL import Image, TiffImagePlugin
+from pathlib import Path
+
+import color
+import filter
+
+# Modo de fluxo: a imagem é lida, processada e gravada em faixas de linhas, para que imagens
+# maiores que a memória possam ser processadas. Cada filtro guarda de uma faixa para a outra
+# só as linhas do kernel - 1 que ainda são necessárias (ver AbstractFilter.stream)
+
+# número de bandas dos dados sem compressão que podem ser mapeados em memória
+RAW_MODES = {'RGB': 3, 'L': 1}
+# tags do TIFF copiadas para o TIFF de cada faixa (as que dizem como os dados da faixa são decodificados)
+STRIP_TAGS = (258, 259, 262, 266, 277, 284, 317, 320, 332, 338, 339, 347, 530, 531, 532)
+# faixas de cada efeito esperando na fila entre a leitura e o processamento
+DEFAULT_QUEUE_STRIPS = 2
+
+
+def _raw_segments(path, img):
+    """mapeia em memória os dados sem compressão da imagem (TIFF, PPM...), um segmento de linhas
+    por bloco de dados do arquivo; retorna None se a imagem precisar ser decodificada"""
+    width, height = img.size
+    segments = []
+    for codec, extents, offset, args in sorted(img.tile, key=lambda tile: tile[1][1]):
+        # PPM guarda só o modo; TIFF guarda (modo, tamanho da linha, orientação)
+        rawmode, stride, orientation = (args, 0, 1) if isinstance(args, str) else (tuple(args) + (0, 1))[:3]
+        bands = RAW_MODES.get(rawmode)
+        if (codec != 'raw' or rawmode != img.mode or bands is None
+                or extents[0] != 0 or extents[2] != width or stride not in (0, width * bands) or orientation != 1):
+            return None
+        segments.append(np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(extents[3] - extents[1], width, bands)))
+    # os segmentos precisam cobrir todas as linhas da imagem
+    if sum(segment.shape[0] for segment in segments) != height:
+        return None
+    return segments
+
+
+def _tiff_strips(path, tags, width, height, mode):
+    """decodifica um TIFF comprimido uma faixa do arquivo por vez: os dados de cada faixa são lidos
+    do arquivo e decodificados pelo PIL como um TIFF com só essa faixa"""
+    rows_per_strip = tags.get(278, height)
+    byte_order = '<' if tags.prefix == b'II' else '>'
+    with open(path, 'rb') as file:
+        for index, (offset, count) in enumerate(zip(tags[273], tags[279])):
+            rows = min(rows_per_strip, height - index * rows_per_strip)
+            ifd = TiffImagePlugin.ImageFileDirectory_v2(prefix=tags.prefix)
+            for tag in STRIP_TAGS:
+                if tag in tags:
+                    ifd[tag] = tags[tag]
+                    ifd.tagtype[tag] = tags.tagtype[tag]
+            # o PIL grava o offset da faixa a partir do fim do diretório de tags: 0 é logo depois dele
+            for tag, value in ((256, width), (257, rows), (278, rows), (273, 0), (279, count)):
+                ifd[tag] = value
+                ifd.tagtype[tag] = 4
+            file.seek(offset)
+            header = tags.prefix + struct.pack(byte_order + 'HI', 42, 8)
+            with Image.open(io.BytesIO(header + ifd.tobytes(8) + file.read(count))) as strip:
+                yield np.asarray(strip.convert(mode)).reshape(rows, width, -1)
+
+
+def open_rows(path, grayscale=False):
+    """abre a imagem como um iterável de segmentos de linhas (arrays linhas x colunas x bandas de uint8)
+    arquivos .npy e imagens sem compressão são mapeados em memória, sem serem lidos; TIFFs comprimidos
+    organizados em faixas são decodificados uma faixa por vez; os outros formatos (JPEG, PNG...)
+    precisam ser decodificados inteiros pelo PIL"""
+    path = Path(path)
+    if path.suffix.lower() == '.npy':
+        array = np.load(path, mmap_mode='r')
+        return [array[:, :, np.newaxis] if array.ndim == 2 else array]
+    mode = 'L' if grayscale else 'RGB'
+    with Image.open(path) as img:
+        segments = _raw_segments(path, img)
+        if segments is not None:
+            return segments
+        if img.format == 'TIFF':
+            tags = img.tag_v2
+            # TIFFs em blocos (tiles) ou com as bandas em planos separados teriam que ser decodificados inteiros
+            if 322 in tags or tags.get(284, 1) != 1 or 273 not in tags or 279 not in tags:
+                raise ValueError(f'{path} is a tiled or planar TIFF, which can not be read in strips; convert it to a striped TIFF first')
+            return _tiff_strips(path, tags, img.size[0], img.size[1], mode)
+        img = img.convert(mode)
+        return [np.asarray(img).reshape(img.size[1], img.size[0], -1)]
+
+
+def image_size(path):
+    """dimensões (linhas, colunas) da imagem, sem decodificá-la quando possível"""
+    path = Path(path)
+    if path.suffix.lower() == '.npy':
+        return np.load(path, mmap_mode='r').shape[:2]
+    with Image.open(path) as img:
+        return img.size[1], img.size[0]
+
+
+def _to_rgb(strip, grayscale=False):
+    """converte uma faixa lida de open_rows para RGB de 8 bits"""
+    if strip.shape[2] == 1:
+        return np.repeat(strip, 3, axis=2)
+    if grayscale:
+        return np.asarray(Image.fromarray(strip).convert('L').convert('RGB'))
+    return strip
+
+
+def read_strips(path, strip_rows, grayscale=False):
+    """lê a imagem em faixas de até strip_rows linhas, convertidas para RGB de 8 bits"""
+    for segment in open_rows(path, grayscale):
+        for row in range(0, segment.shape[0], strip_rows):
+            # copia só a faixa para a memória
+            yield _to_rgb(np.array(segment[row:row + strip_rows]), grayscale)
+
+
+def read_region(path, rows, columns, grayscale=False):
+    """lê só a região (linhas e colunas como intervalos [início, fim)) da imagem, em RGB de 8 bits;
+    só os arquivos mapeados em memória e os TIFFs em faixas (ver open_rows) são lidos em parte"""
+    parts = []
+    start = 0
+    for segment in open_rows(path, grayscale):
+        if start >= rows[1]:
+            break
+        stop = start + segment.shape[0]
+        if start < rows[1] and stop > rows[0]:
+            part = segment[max(rows[0], start) - start:min(rows[1], stop) - start, columns[0]:columns[1]]
+            parts.append(_to_rgb(np.array(part), grayscale))
+        start = stop
+    return np.concatenate(parts)
+
+
+def rechunk(strips, strip_rows):
+    """reagrupa faixas de tamanhos variados em faixas de strip_rows linhas (a última pode ser menor)"""
+    pending = []
+    pending_rows = 0
+    for strip in strips:
+        pending.append(strip)
+        pending_rows += strip.shape[0]
+        if pending_rows >= strip_rows:
+            buffer = np.concatenate(pending)
+            full_rows = pending_rows - pending_rows % strip_rows
+            for row in range(0, full_rows, strip_rows):
+                yield buffer[row:row + strip_rows]
+            pending = [buffer[full_rows:]]
+            pending_rows -= full_rows
+    if pending_rows:
+        yield np.concatenate(pending)
+
+
+def write_strips(path, strips, height, width):
+    """grava as faixas de uma imagem RGB de 8 bits à medida que são geradas, sem montar a imagem
+    inteira: em um .npy mapeado em memória ou em um PPM binário (P6)"""
+    path = Path(path)
+    rows = 0
+    if path.suffix.lower() == '.npy':
+        output = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(height, width, 3))
+        for strip in strips:
+            output[rows:rows + strip.shape[0]] = strip
+            rows += strip.shape[0]
+        output.flush()
+        del output
+    else:
+        with path.open('wb') as file:
+            file.write(f'P6\n{width} {height}\n255\n'.encode())
+            for strip in strips:
+                file.write(np.ascontiguousarray(strip, dtype=np.uint8).tobytes())
+                rows += strip.shape[0]
+    if rows != height:
+        raise ValueError(f'Stream for {path} produced {rows} rows, expected {height}')
+
+
+def _drain(strips):
+    """faixas da fila até o fim (None)"""
+    while True:
+        strip = strips.get()
+        if strip is None:
+            return
+        yield strip
+
+
+def broadcast(strips, consumers, size=DEFAULT_QUEUE_STRIPS):
+    """lê as faixas uma só vez e as passa a todos os consumidores (funções que recebem um iterável
+    de faixas), cada um em uma thread que recebe as faixas por uma fila de size faixas"""
+    errors = []
+
+    def consume(consumer, strips):
+        try:
+            consumer(strips)
+        except Exception as e:
+            errors.append(e)
+        # esvazia a fila até o fim, para que a leitura não fique esperando por uma thread que parou
+        for _ in strips:
+            pass
+
+    queues = [queue.Queue(size) for _ in consumers]
+    threads = [threading.Thread(target=consume, args=(consumer, _drain(items)), daemon=True) for consumer, items in zip(consumers, queues)]
+    for thread in threads:
+        thread.start()
+    try:
+        for strip in strips:
+            for items in queues:
+                items.put(strip)
+    finally:
+        for items in queues:
+            items.put(None)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def process(image_path, args):
+    """aplica as operações da linha de comando em modo de fluxo, gravando cada resultado
+    no mesmo diretório e com o mesmo nome da imagem, com '_<efeito>' antes da extensão;
+    a imagem é lida uma só vez, e todos os efeitos são calculados ao mesmo tempo, faixa a faixa"""
+    path = Path(image_path)
+    height, width = image_size(image_path)
+    # (nome do efeito, dimensões do resultado, função que gera as faixas do resultado a partir das da imagem)
+    effects = []
+
+    # operações pixel a pixel
+    if args.yiq:
+        effects.append(('yiq', (height, width), lambda strips: map(color.rgb_yiq_rgb, strips)))
+    if args.neg_rgb:
+        effects.append(('neg_rgb', (height, width), lambda strips: map(color.negative_rgb, strips)))
+    if args.neg_y:
+        effects.append(('neg_y', (height, width), lambda strips: map(color.negative_y, strips)))
+
+    def sequence(filters):
+        def run(strips):
+            # cada filtro da sequência consome as faixas geradas pelo anterior
+            for new_filter in filters:
+                strips = new_filter.stream(strips, args.workers, args.tile_rows)
+            return strips
+        return run
+
+    def summed(filters):
+        def run(strips):
+            # os filtros da soma são aplicados lado a lado, faixa a faixa, sobre cópias das mesmas faixas
+            copies = itertools.tee(strips, len(filters))
+            filtered = zip(*(rechunk(new_filter.stream(copy, args.workers, args.tile_rows), args.strip_rows) for new_filter, copy in zip(filters, copies)))
+            # a soma é feita em inteiros, para não transbordar os 8 bits
+            sums = (sum(part.astype(np.int32) for part in parts) for parts in filtered)
+            return (strip.astype(np.uint8) for strip in filter.stream_histogram_expansion(sums))
+        return run
+
+    if args.filter:
+        for f in args.filter:
+            new_filter = filter.load_filter(f, args.engine)
+            effects.append((f'filter-{new_filter.name}', new_filter.output_shape(height, width), sequence([new_filter])))
+
+    if args.filter_sequence:
+        for fs in args.filter_sequence:
+            filters, shape = [], (height, width)
+            for f in fs:
+                filters.append(filter.load_filter(f, args.engine))
+                shape = filters[-1].output_shape(*shape)
+            effects.append((f'filter sequence-{[Path(f).stem for f in fs]}', shape, sequence(filters)))
+
+    if args.filter_sum:
+        for fs in args.filter_sum:
+            filters = [filter.load_filter(f, args.engine) for f in fs]
+            shapes = {new_filter.output_shape(height, width) for new_filter in filters}
+            if len(shapes) > 1:
+                raise ValueError(f'Filters in filter sum {fs} produce images of different sizes')
+            effects.append((f'filter sum-{[Path(f).stem for f in fs]}', shapes.pop(), summed(filters)))
+
+    def saver(effect_name, shape, run):
+        return lambda strips: write_strips(f'{path.parent}/{path.stem}_{effect_name}.{args.stream_format}', run(strips), *shape)
+
+    if effects:
+        broadcast(read_strips(image_path, args.strip_rows, args.grayscale), [saver(*effect) for effect in effects])
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+from pathlib import Path
+
+import cache
+import display
+import pipeline
+
+# Modo de observação (opção --watch do src/main.py): a imagem e os arquivos json dos filtros são
+# verificados periodicamente e, quando algum muda, os resultados são recalculados e a exibição (ou
+# os arquivos salvos) é atualizada. Os resultados de cada etapa ficam em um cache em memória com as
+# mesmas chaves do cache de resultados (o conteúdo da imagem e a descrição dos filtros de cada
+# prefixo das sequências), então só as etapas a partir do primeiro filtro alterado são reaplicadas.
+
+# memória usada pelos resultados das etapas quando --cache-memory não é dado
+DEFAULT_MEMORY_BYTES = 1 << 30
+
+
+def watched_paths(args):
+    """arquivos observados: a imagem e os filtros json citados nas opções"""
+    return [args.FILE] + [f for f in pipeline.filter_specs(args) if not (f[0] == '[' and f[-1] == ']')]
+
+
+def snapshot(paths):
+    """data de modificação e tamanho de cada arquivo (None se ele não existir no momento)"""
+    state = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            state[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            state[path] = None
+    return state
+
+
+class Output:
+    """exibe ou salva os resultados, substituindo os da atualização anterior"""
+
+    def __init__(self, args):
+        self.args = args
+        # último resultado mostrado de cada efeito: os que vieram iguais do cache não são refeitos
+        self.shown = {}
+
+    def update(self, results, status):
+        output = self.args.output
+        if output in ('terminal', 'terminal-numbers'):
+            handler = display.terminal if output == 'terminal' else display.terminal_numbers
+            display.clear_terminal()
+            for _, title, result in results:
+                handler(result, title)
+        for effect_name, title, result in results:
+            if self.shown.get(effect_name) is result:
+                continue
+            self.shown[effect_name] = result
+            if output == 'matplotlib':
+                display.matplotlib_update(result, title)
+            elif output == 'save':
+                print(pipeline.save_img(result, self.args.FILE, effect_name))
+        print(status, flush=True)
+
+    def wait(self, seconds):
+        if self.args.output == 'matplotlib':
+            # mantém as janelas respondendo
+            display.plt.pause(seconds)
+        else:
+            time.sleep(seconds)
+
+
+def run(args):
+    """recalcula e atualiza os resultados sempre que a imagem ou um filtro json mudar (até Ctrl+C)"""
+    memory = int(args.cache_memory * 2**20) or DEFAULT_MEMORY_BYTES
+    stages = cache.ResultCache(None, memory_bytes=memory)
+    output = Output(args)
+    paths = watched_paths(args)
+    previous = None
+    try:
+        while True:
+            state = snapshot(paths)
+            if state != previous:
+                previous = state
+                start = time.perf_counter()
+                try:
+                    filters = pipeline.load_filters(args)
+                    img_arr = pipeline.open_image(args.FILE, args.grayscale)
+                    results = list(pipeline.process(img_arr, args, filters, stages, incremental=True))
+                except (OSError, ValueError, KeyError) as e:
+                    # arquivo sendo gravado ou inválido: espera a próxima mudança
+                    print(f'error: {e}', file=sys.stderr, flush=True)
+                else:
+                    # a imagem original é exibida (não salva) antes dos resultados
+                    if not args.no_original and args.output != 'save':
+                        original = img_arr if args.roi is None else pipeline.crop(img_arr, args.roi)
+                        results.insert(0, ('original', 'Original Image', original))
+                    output.update(results, f'updated in {(time.perf_counter() - start) * 1e3:.0f} ms, watching {", ".join(Path(path).name for path in paths)} (Ctrl+C to stop)')
+            output.wait(args.watch_interval)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import sys
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import filter
+
+
+def clip_100(arr):
+    return np.clip(arr, 0, 100)
+
+
+def reference(kernel, image, offset, limit_function):
+    """filtro original: correlação pixel a pixel, limite e arredondamento"""
+    rows, columns = kernel.shape[:2]
+    result = np.empty((image.shape[0] - rows + 1, image.shape[1] - columns + 1, 3))
+    for i in range(result.shape[0]):
+        for j in range(result.shape[1]):
+            result[i, j] = np.sum(image[i:i + rows, j:j + columns] * kernel, axis=(0, 1)) + offset
+    return limit_function(result).round().astype(np.uint8)
+
+
+def test_custom_limit_function():
+    """uma função de limite fora de LIMIT_FUNCTIONS é chamada como no filtro original"""
+    image = np.random.default_rng(0).integers(0, 256, (12, 10, 3), dtype=np.uint8)
+    kernel = np.repeat(np.full((3, 3), 1 / 9)[:, :, np.newaxis], 3, axis=2)
+    for limit_function in (clip_100, lambda arr: np.clip(arr, 0, 100)):
+        for engine in filter.ENGINES:
+            f = filter.DataFilter('clip100', kernel, (1, 1), False, limit_function, 7, False, engine)
+            assert np.array_equal(f.apply(image), reference(kernel, image, 7, limit_function))
+            assert f.spec()['limit_function'].startswith('custom:')
+
+
+def test_custom_limit_function_1x1():
+    image = np.random.default_rng(1).integers(0, 256, (5, 4, 3), dtype=np.uint8)
+    kernel = np.array([[[2.0, 1.0, 0.5]]])
+    f = filter.DataFilter('scale', kernel, (0, 0), True, clip_100, 0, False)
+    assert np.array_equal(f.apply(image), reference(kernel, image, 0, clip_100))
+
+
+def test_custom_limit_function_integer_offset():
+    """o offset é somado em ponto flutuante, fora do acumulador inteiro (int16 aqui)"""
+    image = np.full((5, 5, 3), 255, dtype=np.uint8)
+    kernel = np.zeros((3, 3, 3))
+    kernel[1, 1], kernel[0, 0] = 100, 27
+    f = filter.DataFilter('big', kernel, (1, 1), False, clip_100, 500, False, 'direct')
+    assert f.integer_plan['dtype'] == np.int16
+    assert np.array_equal(f.apply(image), reference(kernel, image, 500, clip_100))
+
+
+def test_custom_limit_function_spec():
+    """funções de limite diferentes dão chaves de cache diferentes"""
+    kernel = np.ones((1, 1))
+    specs = {filter.DataFilter('f', kernel, (0, 0), True, function, 0, False).spec()['limit_function']
+             for function in (clip_100, lambda arr: np.clip(arr, 0, 100), lambda arr: np.clip(arr, 0, 50))}
+    assert len(specs) == 3
+
+
+def test_auto_engine_matches_direct():
+    """o auto só usa a FFT quando o resultado dela é corrigido para o exato (kernel diádico)"""
+    rng = np.random.default_rng(2)
+    image = rng.integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    # kernels de posto cheio (sem passe separável): um não diádico e um diádico
+    kernels = [rng.random((6, 6)) / 18, rng.integers(-8, 9, (9, 9)) / 16]
+    for kernel in kernels:
+        for expansion in (False, True):
+            auto = filter.DataFilter('auto', kernel, (2, 5), False, filter.LIMIT_FUNCTIONS['clip'], 0, expansion)
+            direct = filter.DataFilter('direct', kernel, (2, 5), False, filter.LIMIT_FUNCTIONS['clip'], 0, expansion, 'direct')
+            assert (auto.select_engine(*auto.output_shape(300, 400)) == 'fft') == (auto.dyadic_scale is not None)
+            assert np.array_equal(auto.apply(image), direct.apply(image))
+
+
+def test_auto_engine_separable_matches_direct():
+    """kernels de posto 1 não diádicos (box 1/6, 1/14) não usam o passe separável em ponto flutuante"""
+    image = np.random.default_rng(3).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    for shape, expansion in (((2, 3), False), ((7, 2), True), ((3, 3), False)):
+        kernel = np.full(shape, 1 / (shape[0] * shape[1]))
+        auto = filter.DataFilter('auto', kernel, (0, shape[1] - 1), False, filter.LIMIT_FUNCTIONS['clip'], 0, expansion)
+        direct = filter.DataFilter('direct', kernel, (0, shape[1] - 1), False, filter.LIMIT_FUNCTIONS['clip'], 0, expansion, 'direct')
+        assert auto.select_engine(*auto.output_shape(120, 160)) == 'direct'
+        assert np.array_equal(auto.apply(image), direct.apply(image))
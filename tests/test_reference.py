@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import argparse
+import sys
+from pathlib import Path
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+import cache
+import filter
+import pipeline
+import stream
+
+# Compara os motores vetorizados com o filtro original, pixel a pixel, para todos os filtros json
+
+FILTERS = sorted((Path(__file__).resolve().parent.parent / 'filters').glob('*.json'))
+TILINGS = ({}, {'workers': 3, 'tile_rows': 4})
+
+
+def images():
+    """ruído e uma imagem com uma banda constante (a expansão de histograma dela dá 0)"""
+    rng = np.random.default_rng(7)
+    noise = rng.integers(0, 256, (17, 23, 3), dtype=np.uint8)
+    flat = noise.copy()
+    flat[:, :, 1] = 90
+    return {'noise': noise, 'flat': flat}
+
+
+def expansion(arr):
+    """expansão de histograma original, com 0 nas bandas constantes"""
+    arr = np.array(arr, dtype=float)
+    for band in range(arr.shape[2]):
+        low, high = arr[:, :, band].min(), arr[:, :, band].max()
+        arr[:, :, band] = np.round((arr[:, :, band] - low) / (high - low) * 255) if high > low else 0
+    return arr
+
+
+LIMITS = {
+    'clip': lambda arr: np.clip(arr, 0, 255),
+    'absolute': lambda arr: np.clip(np.abs(arr), 0, 255),
+    'renormalize': expansion,
+    'abs-renormalize': lambda arr: expansion(np.abs(arr)),
+}
+
+
+def reference(f, image):
+    """filtro original: correlação pixel a pixel, offset, limite, arredondamento e expansão
+    sem extensão por zeros, a área de aplicação termina (nas colunas) no padding de antes do pivô"""
+    rows, columns = f.kernel.shape[:2]
+    before = f.pivot
+    after = (rows - f.pivot[0] - 1, columns - f.pivot[1] - 1)
+    if f.zero_extension:
+        image = np.pad(image, ((before[0], after[0]), (before[1], after[1]), (0, 0)))
+        height, width = image.shape[0] - rows + 1, image.shape[1] - columns + 1
+    else:
+        height, width = image.shape[0] - rows + 1, image.shape[1] - 2 * before[1]
+    new_img = np.empty((height, width, 3))
+    for i in range(height):
+        for j in range(width):
+            new_img[i, j] = np.sum(image[i:i + rows, j:j + columns] * f.kernel, axis=(0, 1)) + f.offset
+    result = LIMITS[filter.LIMIT_NAMES[f.limit_function]](new_img).round().astype(np.uint8)
+    return expansion(result).astype(np.uint8) if f.histogram_expansion else result
+
+
+def variants(f):
+    """o filtro do arquivo com as duas extensões e pivôs fora do centro; sem extensão por zeros,
+    só os pivôs com padding de antes >= padding de depois nas colunas (os outros não valiam no original)"""
+    rows, columns = f.kernel.shape[:2]
+    pivots = {f.pivot, (0, columns - 1), (rows - 1, columns - 1), (rows - 1, 0), (0, 0)}
+    for zero_extension in (True, False):
+        for pivot in sorted(pivots):
+            if zero_extension or pivot[1] >= columns - 1 - pivot[1]:
+                yield filter.DataFilter(f.name, f.kernel, pivot, zero_extension, f.limit_function, f.offset, f.histogram_expansion)
+
+
+def exact(f, engine, dtype=np.uint8):
+    """o motor dá o mesmo resultado da correlação direta (o auto sempre; a FFT e o passe separável
+    forçados só com os planos exatos de kernels diádicos)"""
+    if engine == 'fft':
+        return f.dyadic_scale is not None and np.issubdtype(dtype, np.integer)
+    if engine == 'separable':
+        return f.separable is None or (f.integer_plan is not None and f.integer_plan['separable'] is not None and dtype == np.uint8)
+    return True
+
+
+@pytest.mark.parametrize('path', FILTERS, ids=lambda path: path.stem)
+def test_engines_match_reference(path):
+    for f in variants(filter.DataFilter.from_json(path)):
+        for image in images().values():
+            expected = reference(f, image)
+            for engine in filter.ENGINES:
+                g = filter.DataFilter(f.name, f.kernel, f.pivot, f.zero_extension, f.limit_function, f.offset, f.histogram_expansion, engine)
+                for tiling in TILINGS:
+                    result = g.apply(image, **tiling)
+                    assert result.shape == expected.shape, (f.pivot, f.zero_extension, engine, tiling)
+                    # a FFT e os fatores em ponto flutuante podem mudar um valor arredondado
+                    tolerance = 0 if exact(g, engine) else 1 if f.local else 255
+                    assert np.abs(result.astype(int) - expected).max() <= tolerance, (f.pivot, f.zero_extension, engine, tiling)
+
+
+@pytest.mark.parametrize('path', FILTERS, ids=lambda path: path.stem)
+def test_stream_and_roi_match_reference(path):
+    f = filter.DataFilter.from_json(path)
+    for image in images().values():
+        expected = reference(f, image)
+        strips = (image[start:start + 5] for start in range(0, image.shape[0], 5))
+        assert np.array_equal(np.concatenate(list(f.stream(strips))), expected)
+        height, width = expected.shape[:2]
+        for roi in ((0, 0, width, height), (2, 3, 7, 4), (width - 1, height - 1, 1, 1)):
+            x, y, roi_width, roi_height = roi
+            assert np.array_equal(f.apply(image, roi=roi, workers=2, tile_rows=3), expected[y:y + roi_height, x:x + roi_width])
+
+
+def test_sum_matches_reference():
+    """soma sem transbordar em 8 bits, com a expansão de histograma da soma"""
+    image = images()['noise']
+    for names in (('sobelh', 'sobelv'), ('gauss3', 'mean3', 'sum3'), ('randblur3', 'mean9', 'red'), ('emboss3', 'sobel')):
+        filters = [filter.DataFilter.from_json(path) for path in FILTERS if path.stem in names]
+        expected = expansion(sum(reference(f, image).astype(int) for f in filters)).astype(np.uint8)
+        for tiling in TILINGS:
+            assert np.array_equal(filter.apply_sum(filters, image, **tiling), expected)
+            # em ponto flutuante, os termos não são arredondados antes da soma (até 0,5 de diferença cada)
+            assert np.abs(filter.apply_sum(filters, image, float_pipeline=True, **tiling).astype(int) - expected).max() <= len(filters)
+
+
+def test_sequence_matches_reference():
+    image = images()['noise']
+    for names in (('gauss3', 'mean3'), ('mean11x1', 'mean1x11', 'gauss3'), ('mean9', 'sobel'), ('red', 'emboss2', 'sum3')):
+        filters = [filter.DataFilter.from_json(path) for name in names for path in FILTERS if path.stem == name]
+        expected = image
+        for f in filters:
+            expected = reference(f, expected)
+        assert np.array_equal(filter.apply_sequence(filters, image, workers=2, tile_rows=4), expected)
+        # em ponto flutuante os resultados intermediários não são arredondados; com kernels que não
+        # saem de 0..255 (médias) a diferença para os arredondamentos intermediários fica em 1
+        if all(f.range_preserving for f in filters):
+            assert np.abs(filter.apply_sequence(filters, image, float_pipeline=True).astype(int) - expected).max() <= 1
+
+
+def test_cache_returns_same_results(tmp_path):
+    """resultados calculados, lidos do disco e lidos da memória são iguais"""
+    parser = argparse.ArgumentParser()
+    pipeline.add_processing_arguments(parser)
+    paths = [str(path) for path in FILTERS]
+    args = parser.parse_args(['--filter', paths[0], '--filter-sequence', *paths[2:4], '--filter-sum', *paths[4:7]])
+    filters = pipeline.load_filters(args)
+    image = images()['noise']
+    expected = [result for _, _, result in pipeline.process(image, args, filters)]
+    for _ in range(2):
+        result_cache = cache.ResultCache(tmp_path, memory_bytes=1 << 20)
+        for _ in range(2):
+            results = [result for _, _, result in pipeline.process(image, args, filters, result_cache)]
+            assert len(results) == len(expected)
+            assert all(np.array_equal(result, other) for result, other in zip(results, expected))
+
+
+def test_stream_file_matches_reference(tmp_path):
+    """TIFF comprimido lido faixa a faixa do arquivo, com vários efeitos calculados na mesma leitura"""
+    image = images()['noise']
+    path = tmp_path / 'noise.tif'
+    Image.fromarray(image).save(path, compression='tiff_lzw', tiffinfo={278: 5})
+    assert np.array_equal(np.concatenate(list(stream.read_strips(path, 4))), image)
+    assert np.array_equal(stream.read_region(path, (6, 12), (2, 9)), image[6:12, 2:9])
+    names = {path.stem: path for path in FILTERS}
+    args = argparse.Namespace(yiq=False, neg_rgb=False, neg_y=False, grayscale=False, engine='auto', workers=2, tile_rows=3, strip_rows=4,
+                              stream_format='npy', filter=[str(names['gauss3']), str(names['sobel'])],
+                              filter_sequence=[[str(names['mean3']), str(names['emboss3'])]], filter_sum=[[str(names['sobelh']), str(names['sobelv'])]])
+    stream.process(path, args)
+    gauss3, sobel, mean3, emboss3, sobelh, sobelv = (filter.DataFilter.from_json(names[name]) for name in ('gauss3', 'sobel', 'mean3', 'emboss3', 'sobelh', 'sobelv'))
+    expected = {
+        f'filter-{gauss3.name}': reference(gauss3, image),
+        f'filter-{sobel.name}': reference(sobel, image),
+        "filter sequence-['mean3', 'emboss3']": reference(emboss3, reference(mean3, image)),
+        "filter sum-['sobelh', 'sobelv']": expansion(reference(sobelh, image).astype(int) + reference(sobelv, image)).astype(np.uint8),
+    }
+    for effect_name, result in expected.items():
+        assert np.array_equal(np.load(tmp_path / f'noise_{effect_name}.npy'), result), effect_name